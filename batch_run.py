@@ -1,7 +1,9 @@
-from model import EpsteinCivilViolence
-from mesa import batch_run
+import os
+import sys
 
-import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "epstein_civil_violence"))
+
+from epstein_civil_violence.sweep import run_sweep
 
 # NOTE: You do not need this as a separate file BUT it can be nice to track
 # can also call the file and it makes things a little cleaner as it runs
@@ -15,17 +17,14 @@ parameters = {"schedule_type": ("Random", "Simultaneous")}
 # what to run and what to collect
 # iterations is how many runs per parameter value
 # max_steps is how long to run the model
-results = batch_run(EpsteinCivilViolence, 
-                    parameters,
-                    iterations=10,  
-                    max_steps=30, 
-                    data_collection_period = -1) #how often do you want to pull the data #blank to do end of run
-
-
-
-
-
-## NOTE: to do data collection, you need to be sure your pathway is correct to save this!
-# Data collection
-# extract data as a pandas Data Frame
-pd.DataFrame(results).to_csv("5_Sheduling/pd_grid/data/batch_data.csv")
\ No newline at end of file
+# runs are spread over all CPUs and appended to the CSV (first argument) as
+# they finish; seed makes the sweep reproducible and runs already in the
+# cache directory are not rerun (see run_sweep for ensemble=True and more)
+if __name__ == "__main__":
+    run_sweep(parameters,
+              sys.argv[1] if len(sys.argv) > 1 else "batch_data.csv",
+              iterations=10,
+              max_steps=30,
+              data_collection_period=-1, #how often do you want to pull the data #blank to do end of run
+              seed=42,
+              cache="batch_cache")
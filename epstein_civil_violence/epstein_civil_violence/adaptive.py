@@ -0,0 +1,324 @@
+import os
+
+import numpy as np
+
+from .sweep import job_seed, run_jobs
+
+# what a run is judged by: the share of its citizens Active and Jailed at the
+# end
+OUTCOMES = ("Active", "Jailed")
+
+DESIGNS = ("lhs", "grid")
+
+
+def latin_hypercube(n, dims, rng):
+    """
+    `n` points in the unit cube with one point in each of the n equal slices
+    of every axis.
+    """
+    slices = np.array([rng.permutation(n) for _ in range(dims)]).T
+    return (slices + rng.random((n, dims))) / n
+
+
+def grid(levels, dims):
+    """
+    The full grid of `levels` evenly spaced values per axis, ends included,
+    in the unit cube.
+    """
+    axis = np.linspace(0, 1, levels)
+    return np.stack(np.meshgrid(*[axis] * dims, indexing="ij"), -1).reshape(-1, dims)
+
+
+def run_outcomes(rows):
+    """
+    OUTCOMES of one run, as shares of its citizens, from its rows.
+    """
+    last = max(rows, key=lambda row: row["Step"])
+    citizens = sum(last[name] for name in ("Quiescent", "Active", "Jailed"))
+    return np.array([last[name] / citizens for name in OUTCOMES])
+
+
+class Point:
+    """
+    A sampled point of the parameter space.
+    Attributes:
+        unit: coordinates in the unit cube
+        kwargs: the model parameters it stands for
+        outcomes: one array of OUTCOMES per finished run
+    """
+
+    __slots__ = ("unit", "kwargs", "outcomes")
+
+    def __init__(self, unit, kwargs):
+        self.unit = unit
+        self.kwargs = kwargs
+        self.outcomes = []
+
+    def mean(self):
+        return np.mean(self.outcomes, 0)
+
+    def stderr(self):
+        """
+        Standard error of mean(), infinite below two runs.
+        """
+        n = len(self.outcomes)
+        if n < 2:
+            return np.full(len(OUTCOMES), np.inf)
+        return np.std(self.outcomes, 0, ddof=1) / np.sqrt(n)
+
+
+class AdaptiveSweep:
+    """
+    Parameter sweep that spends its runs where the outcome changes.
+
+    It starts from a Latin hypercube sample (or a full grid) of the ranges in
+    `bounds`, run `replicates` times per point, then refines round by round.
+    Every point is compared with its 2 * dims nearest neighbors (in the
+    ranges scaled to [0, 1]); where the mean Active or Jailed share of the
+    two differs by more than `tolerance`, and by more than their noise, a
+    new point goes half-way between them, so points pile up along the phase
+    boundaries and stay sparse in the all-quiescent and all-active regions.
+    Points whose replicates disagree too much for the mean to be known
+    within tolerance / 2 (at `z` standard errors) get `replicates` more
+    runs, up to `max_replicates`. Each round takes the most pressing of
+    these until it has about `batch` runs.
+
+    The sweep stops when nothing is left to refine - every neighboring pair
+    closer than `resolution` or alike, every mean known to the confidence
+    asked for - or when the next round would exceed `budget` runs. Every
+    run's rows are appended to `output` as by run_sweep(), with independent
+    per-run seeds derived from `seed`, so a seeded sweep is reproducible
+    and, with a cache, rerunning it computes nothing new.
+    """
+
+    def __init__(
+        self,
+        bounds,
+        output,
+        fixed=None,
+        design="lhs",
+        initial=16,
+        replicates=3,
+        max_replicates=12,
+        budget=1000,
+        batch=48,
+        resolution=1 / 32,
+        tolerance=0.1,
+        z=2.0,
+        max_steps=1000,
+        data_collection_period=-1,
+        processes=None,
+        seed=None,
+        cache=None,
+        ensemble=False,
+    ):
+        """
+        Args:
+            bounds: dict of model parameter name to its (low, high) range;
+                a range of two ints is sampled as integers
+            output: path of the CSV file to append every run's rows to
+            fixed: dict of the other model parameters, shared by all runs
+            design: "lhs" for `initial` Latin hypercube points, "grid" for
+                `initial` levels per parameter
+            initial: size of the initial design, see `design`
+            replicates: runs per new point, and per top-up of a noisy one
+            max_replicates: most runs a point gets
+            budget: most runs in total
+            batch: runs per refinement round
+            resolution: closest two points get before no point is put
+                between them, as a share of the ranges
+            tolerance: difference in Active or Jailed share of the citizens
+                that counts as a change of outcome
+            z: standard errors of confidence
+            max_steps, data_collection_period, processes, cache, ensemble:
+                as for run_sweep()
+            seed: root seed of the sweep and of the initial design
+        """
+        if design not in DESIGNS:
+            raise ValueError("Invalid design, choose 'lhs' or 'grid'")
+        self.names = list(bounds)
+        self.low = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.high = np.array([bounds[name][1] for name in self.names], dtype=float)
+        self.span = np.where(self.high > self.low, self.high - self.low, 1)
+        self.integer = [
+            all(isinstance(value, int) for value in bounds[name]) for name in self.names
+        ]
+        self.output = output
+        self.fixed = dict(fixed or {})
+        if ensemble:
+            self.fixed.setdefault("engine", "vectorized")
+        self.replicates = replicates
+        self.max_replicates = max_replicates
+        self.budget = budget
+        self.batch = batch
+        self.resolution = resolution
+        self.tolerance = tolerance
+        self.z = z
+        self.max_steps = max_steps
+        self.data_collection_period = data_collection_period
+        self.processes = processes or os.cpu_count() or 1
+        self.cache = cache
+        self.ensemble = ensemble
+        self.entropy = np.random.SeedSequence(seed).entropy
+        rng = np.random.default_rng(self.entropy)
+        dims = len(self.names)
+        if design == "lhs":
+            self.design = latin_hypercube(initial, dims, rng)
+        else:
+            self.design = grid(initial, dims)
+        self.points = []
+        self._keys = {}
+        self.runs = 0
+        self.rounds = 0
+        self.stop_reason = None
+
+    def point(self, unit):
+        """
+        The point at `unit` in the unit cube, new or (when the integer
+        parameters round it onto one) already sampled, and whether it is new.
+        """
+        values = self.low + np.asarray(unit) * (self.high - self.low)
+        kwargs = {}
+        for name, value, integer in zip(self.names, values.tolist(), self.integer):
+            kwargs[name] = int(round(value)) if integer else round(value, 12)
+        key = tuple(kwargs.values())
+        if key in self._keys:
+            return self._keys[key], False
+        # the unit coordinates of what is actually run
+        unit = (np.array(list(key), dtype=float) - self.low) / self.span
+        point = self._keys[key] = Point(unit, kwargs)
+        self.points.append(point)
+        return point, True
+
+    def evaluate(self, requests):
+        """
+        Run `count` more replicates of each (point, count) in `requests`.
+        """
+        jobs = []
+        owners = {}
+        finished = {}
+        for point, count in requests:
+            done = len(point.outcomes)
+            for iteration in range(done, done + count):
+                kwargs = dict(self.fixed, **point.kwargs)
+                if "seed" not in self.fixed:
+                    kwargs["seed"] = job_seed(self.entropy, kwargs, iteration)
+                owners[self.runs] = point
+                jobs.append((self.runs, iteration, kwargs))
+                self.runs += 1
+        for rows in run_jobs(
+            jobs,
+            self.output,
+            self.max_steps,
+            self.data_collection_period,
+            self.processes,
+            self.cache,
+            self.ensemble,
+        ):
+            for row in rows:
+                finished.setdefault(row["RunId"], []).append(row)
+        # in run order, whatever order the runs finished in
+        for run_id in sorted(finished):
+            owners[run_id].outcomes.append(run_outcomes(finished[run_id]))
+        self.rounds += 1
+
+    def plan(self):
+        """
+        The refinements worth making, most pressing first, as
+        (urgency, unit coordinates of a new point or None, point to top up
+        or None); urgencies above 1 are past the tolerance.
+        """
+        points = self.points
+        units = np.array([point.unit for point in points])
+        means = np.array([point.mean() for point in points])
+        errors = np.array([point.stderr() for point in points])
+        actions = []
+        for point, error in zip(points, errors):
+            urgency = self.z * error.max() / (self.tolerance / 2)
+            if urgency > 1 and len(point.outcomes) < self.max_replicates:
+                actions.append((urgency, None, point))
+        k = min(2 * units.shape[1], len(points) - 1)
+        distance = np.sqrt(((units[:, None] - units[None]) ** 2).sum(-1))
+        neighbors = np.argsort(distance, 1)[:, 1 : k + 1]
+        edges = {
+            (min(i, j), max(i, j)) for i in range(len(points)) for j in neighbors[i]
+        }
+        for i, j in sorted(edges):
+            if distance[i, j] <= self.resolution:
+                continue
+            jump = np.abs(means[i] - means[j])
+            noise = self.z * np.sqrt(errors[i] ** 2 + errors[j] ** 2)
+            # a change too noisy to tell is left to the replicate top-ups
+            jump[jump <= noise] = 0
+            urgency = jump.max() / self.tolerance
+            if urgency > 1:
+                actions.append((urgency, (units[i] + units[j]) / 2, None))
+        actions.sort(key=lambda action: -action[0])
+        return actions
+
+    def step(self):
+        """
+        Run one round: the initial design first, then refinements.
+        Returns:
+            False once the sweep has stopped
+        """
+        if self.stop_reason is not None:
+            return False
+        if not self.points:
+            requests = []
+            for unit in self.design:
+                point, new = self.point(unit)
+                if new:
+                    requests.append((point, self.replicates))
+            if len(requests) * self.replicates > self.budget:
+                raise ValueError("The initial design alone exceeds the budget")
+            self.evaluate(requests)
+            return True
+        requests = {}
+        planned = 0
+        limit = min(self.batch, self.budget - self.runs)
+        for _, unit, point in self.plan():
+            if unit is not None:
+                count = self.replicates
+                if planned + count > limit:
+                    continue
+                point, new = self.point(unit)
+                if not new:
+                    continue
+            else:
+                count = min(self.replicates, self.max_replicates - len(point.outcomes))
+                if point in requests or planned + count > limit:
+                    continue
+            requests[point] = count
+            planned += count
+        if not requests:
+            self.stop_reason = "budget" if limit < self.replicates else "converged"
+            return False
+        self.evaluate(list(requests.items()))
+        return True
+
+    def run(self):
+        """
+        Refine until converged or out of budget.
+        Returns:
+            summary()
+        """
+        while self.step():
+            pass
+        return self.summary()
+
+    def summary(self):
+        """
+        One dict per point: its parameters, number of runs, and mean and
+        standard error of each outcome share.
+        """
+        rows = []
+        for point in self.points:
+            if not point.outcomes:
+                continue
+            row = dict(point.kwargs, runs=len(point.outcomes))
+            for name, mean, error in zip(OUTCOMES, point.mean(), point.stderr()):
+                row[f"{name}_mean"] = float(mean)
+                row[f"{name}_stderr"] = float(error)
+            rows.append(row)
+        return rows
@@ -2,6 +2,26 @@ import math
 
 import mesa
 
+from .aggregates import ACTIVE, COPS, FREE_CITIZENS, GRIEVANCE, JAILED, OCCUPIED
+from .profiling import ACTIVATION, ARREST_PROBABILITY, ARRESTS, MOVEMENT, NEIGHBORS
+
+# Integer codes: Citizen.condition is stored as an index into CONDITIONS and
+# breed_code indexes BREEDS
+CONDITIONS = ("Quiescent", "Active")
+BREEDS = ("citizen", "cop")
+
+
+def random_empty_cell(agent):
+    """
+    A uniformly random empty cell (flat index) within the agent's vision, or
+    None: the aggregates' occupied count settles whether there is one, and
+    the neighborhood index samples it without listing the neighborhood.
+    """
+    model = agent.model
+    if not model.aggregates.has_empty_cell(agent.pos, agent.vision):
+        return None
+    return model.neighborhoods.random_empty_cell(agent.pos, agent.vision, agent.random)
+
 
 class Citizen(mesa.Agent):
     """
@@ -26,8 +46,29 @@ class Citizen(mesa.Agent):
             how aggrieved is agent at the regime?
         arrest_probability: agent's assessment of arrest probability, given
             rebellion
+
+    Citizens are slotted and keep their condition as an integer code; breed
+    is a class attribute. Neighborhoods are shared read-only rows of the
+    model's neighborhood index rather than per-agent lists.
     """
 
+    __slots__ = (
+        "hardship",
+        "regime_legitimacy",
+        "risk_aversion",
+        "threshold",
+        "vision",
+        "_condition",
+        "_jail_sentence",
+        "_grievance",
+        "arrest_probability",
+        "planned",
+        "target",
+        "release",
+    )
+    breed = "citizen"
+    breed_code = 0
+
     def __init__(
         self,
         unique_id,
@@ -56,103 +97,206 @@ class Citizen(mesa.Agent):
             model: model instance
         """
         super().__init__(unique_id, model)
-        self.breed = "citizen"
         self.pos = pos
         self.hardship = hardship
         self.regime_legitimacy = regime_legitimacy
         self.risk_aversion = risk_aversion
         self.threshold = threshold
-        self.condition = "Quiescent"
         self.vision = vision
-        self.jail_sentence = 0
-        self.grievance = self.hardship * (1 - self.regime_legitimacy)
+        # not tracked by the aggregates yet, so no changes to report
+        self._condition = CONDITIONS.index("Quiescent")
+        self._jail_sentence = 0
+        self._grievance = self.hardship * (1 - self.regime_legitimacy)
         self.arrest_probability = None
+        self.planned = self.target = None
+        self.release = None
+
+    # condition, jail_sentence and grievance feed the model's neighborhood
+    # aggregates, so changes are reported as they happen
+    @property
+    def condition(self):
+        return CONDITIONS[self._condition]
+
+    @condition.setter
+    def condition(self, value):
+        self._condition = CONDITIONS.index(value)
+        self._report_change()
+
+    @property
+    def condition_code(self):
+        return self._condition
+
+    # while the active-set schedule holds a jailed citizen, the sentence is
+    # counted down by the step it is released at
+    @property
+    def jail_sentence(self):
+        if self.release is None:
+            return self._jail_sentence
+        return self.release - self.model.schedule.steps
+
+    @jail_sentence.setter
+    def jail_sentence(self, value):
+        self._jail_sentence = value
+        self.release = None
+        self._report_change()
+
+    @property
+    def grievance(self):
+        return self._grievance
+
+    @grievance.setter
+    def grievance(self, value):
+        self._grievance = value
+        self._report_change()
+
+    def _report_change(self):
+        aggregates = getattr(self.model, "aggregates", None)
+        if aggregates is not None:
+            aggregates.update(self)
 
     def step(self):
         """
         Decide whether to activate, then move if applicable.
         """
+        if self.update_state() and self.model.movement:
+            self.move()
+
+    # Stages: update_state and move make up step() and are run one after the
+    # other over all agents by the staged scheduler; plan, commit_state and
+    # commit_move are the two phases of simultaneous updating.
+
+    def update_state(self):
+        """
+        Serve a step of jail time, or decide whether to activate. Returns
+        whether the citizen was free.
+        """
         if self.jail_sentence:
             self.jail_sentence -= 1
-            return  # no other changes or movements if agent is in jail.
-        self.update_neighbors()
+            return False  # no other changes or movements if agent is in jail.
+        self.grievance, self.condition = self.decide()
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(ACTIVATION)
+        return True
+
+    def decide(self):
+        """
+        Estimate the arrest probability and work out the grievance and
+        condition to take on, without changing any state other agents see.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
         self.update_estimated_arrest_probability()
         net_risk = self.risk_aversion * self.arrest_probability
+        if profiler:
+            profiler.lap(ARREST_PROBABILITY)
         ##
         adjusted_legitimacy = self.calculate_legitimacy_adjustment()
-        self.grievance = self.hardship * (1 - adjusted_legitimacy)
+        grievance = self.hardship * (1 - adjusted_legitimacy)
         ##
-        if self.grievance - net_risk > self.threshold:
-            self.condition = "Active"
+        if grievance - net_risk > self.threshold:
+            return grievance, "Active"
+        return grievance, "Quiescent"
+
+    def move_target(self):
+        """
+        A random empty cell (flat index) within vision, or None.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        target = random_empty_cell(self)
+        if profiler:
+            profiler.lap(NEIGHBORS)
+        return target
+
+    def move(self):
+        """
+        Move to a random empty cell within vision, unless jailed.
+        """
+        if self.jail_sentence:
+            return
+        target = self.move_target()
+        if target is not None:
+            self.model.move_agent(self, self.model.neighborhoods.coordinates(target))
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(MOVEMENT)
+
+    def plan(self):
+        """
+        Work out this step's update from the state at the start of the step
+        (the compute phase of simultaneous updating).
+        """
+        if self.jail_sentence:
+            self.planned = self.target = None
+            return
+        self.planned = self.decide()
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(ACTIVATION)
+        self.target = self.move_target() if self.model.movement else None
+
+    def commit_state(self):
+        """
+        Apply the planned condition and grievance, or serve jail time.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        if self.planned is None:
+            self.jail_sentence -= 1
         else:
-            self.condition = "Quiescent"
-        if self.model.movement and self.empty_neighbors:
-            new_pos = self.random.choice(self.empty_neighbors)
-            self.model.grid.move_agent(self, new_pos)
-
-    # def update_neighbors(self):
-    #     """
-    #     Look around and see who my neighbors are
-    #     """
-    #     self.neighborhood = self.model.grid.get_neighborhood(
-    #         self.pos, moore=True, radius=self.vision
-    #     )
-    #     self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-    #     self.empty_neighbors = [
-    #         c for c in self.neighborhood if self.model.grid.is_cell_empty(c)
-    #     ]
+            self.grievance, self.condition = self.planned
+        if profiler:
+            profiler.lap(ACTIVATION)
 
-    def update_neighbors(self):
+    def commit_move(self):
         """
-        Look around and see who my neighbors are in a hexagonal grid.
+        Move to the planned cell unless arrested or beaten to it.
         """
-        # Include_center=False to exclude the agent's own cell from the neighborhood
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos,
-            include_center=False,
-            radius=self.vision
-        )
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-        self.empty_neighbors = [
-            pos for pos in self.neighborhood if self.model.grid.is_cell_empty(pos)
-        ]
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        target, self.target = self.target, None
+        if (
+            target is not None
+            and not self.jail_sentence
+            and not self.model.neighborhoods.occupied[target]
+        ):
+            self.model.move_agent(self, self.model.neighborhoods.coordinates(target))
+        if profiler:
+            profiler.lap(MOVEMENT)
 
     def update_estimated_arrest_probability(self):
         """
         Based on the ratio of cops to actives in my neighborhood, estimate the
         p(Arrest | I go active).
         """
-        cops_in_vision = len([c for c in self.neighbors if c.breed == "cop"])
+        aggregates = self.model.aggregates
+        cops_in_vision = aggregates.count(self.pos, self.vision, COPS)
         actives_in_vision = 1.0  # citizen counts herself
-        for c in self.neighbors:
-            if (
-                c.breed == "citizen"
-                and c.condition == "Active"
-                and c.jail_sentence == 0
-            ):
-                actives_in_vision += 1
+        actives_in_vision += aggregates.count(self.pos, self.vision, ACTIVE)
         self.arrest_probability = 1 - math.exp(
             -1 * self.model.arrest_prob_constant * (cops_in_vision / actives_in_vision)
         )
     ##
     def calculate_legitimacy_adjustment(self):
-        jailed_neighbors = 0
-        for neighbor in self.neighbors:
-            if getattr(neighbor, "jail_sentence", 0) > 0:
-                jailed_neighbors += 1
+        aggregates = self.model.aggregates
+        jailed_neighbors = aggregates.count(self.pos, self.vision, JAILED)
+        neighbors = aggregates.count(self.pos, self.vision, OCCUPIED)
         # Example adjustment formula, adjust as needed
-        adjustment = jailed_neighbors / len(self.neighbors) if self.neighbors else 0
+        adjustment = jailed_neighbors / neighbors if neighbors else 0
         return max(0, min(1, self.regime_legitimacy + adjustment))
     ###
 
     ###
     def update_grievance(self):
-        nearby_grievances = [self.grievance]  
-        for neighbor in self.neighbors:
-            if neighbor.breed == "citizen" and neighbor.jail_sentence == 0:
-                nearby_grievances.append(neighbor.grievance)
-        
-        self.grievance = sum(nearby_grievances) / len(nearby_grievances)
+        aggregates = self.model.aggregates
+        nearby_total = self.grievance + aggregates.total(self.pos, self.vision, GRIEVANCE)
+        nearby_count = 1 + aggregates.count(self.pos, self.vision, FREE_CITIZENS)
+        self.grievance = nearby_total / nearby_count
     ###
 
 class Cop(mesa.Agent):
@@ -167,6 +311,16 @@ class Cop(mesa.Agent):
             able to inspect
     """
 
+    __slots__ = (
+        "vision",
+        "neighbors",
+        "neighbors_clock",
+        "arrestee",
+        "target",
+    )
+    breed = "cop"
+    breed_code = 1
+
     def __init__(self, unique_id, model, pos, vision):
         """
         Create a new Cop.
@@ -178,57 +332,142 @@ class Cop(mesa.Agent):
             model: model instance
         """
         super().__init__(unique_id, model)
-        self.breed = "cop"
         self.pos = pos
         self.vision = vision
+        self.neighbors = self.neighbors_clock = None
+        self.arrestee = self.target = None
 
     def step(self):
         """
         Inspect local vision and arrest a random active agent. Move if
         applicable.
         """
-        self.update_neighbors()
+        self.arrest()
+        if self.model.movement:
+            self.move()
+
+    # Stages, as for Citizen: arrest and move make up step(); plan,
+    # commit_arrest and commit_move are the phases of simultaneous updating.
+
+    def choose_arrestee(self):
+        """
+        A random free Active citizen within vision, or None.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
         active_neighbors = []
- 
-        for agent in self.neighbors:
-            if (
-                agent.breed == "citizen"
-                and agent.condition == "Active"
-                and agent.jail_sentence == 0
-            ):
-                active_neighbors.append(agent)
+        # only list the neighbors when there is someone to arrest
+        if self.model.aggregates.count(self.pos, self.vision, ACTIVE):
+            self.refresh_neighbors()
+            if profiler:
+                profiler.lap(NEIGHBORS)
+            for agent in self.neighbors:
+                if (
+                    agent.breed == "citizen"
+                    and agent.condition == "Active"
+                    and agent.jail_sentence == 0
+                ):
+                    active_neighbors.append(agent)
         if active_neighbors:
-            arrestee = self.random.choice(active_neighbors)
-            sentence = self.random.randint(0, self.model.max_jail_term)
-            arrestee.jail_sentence = sentence
-            arrestee.condition = "Quiescent"
-        if self.model.movement and self.empty_neighbors:
-            new_pos = self.random.choice(self.empty_neighbors)
-            self.model.grid.move_agent(self, new_pos)
-
-    # def update_neighbors(self):
-    #     """
-    #     Look around and see who my neighbors are.
-    #     """
-    #     self.neighborhood = self.model.grid.get_neighborhood(
-    #         self.pos, moore=True, radius=self.vision
-    #     )
-    #     self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-    #     self.empty_neighbors = [
-    #         c for c in self.neighborhood if self.model.grid.is_cell_empty(c)
-    #     ]
+            return self.random.choice(active_neighbors)
+        return None
+
+    def jail(self, arrestee):
+        sentence = int(
+            self.model.rng.integers(0, self.model.max_jail_term, endpoint=True)
+        )
+        arrestee.jail_sentence = sentence
+        arrestee.condition = "Quiescent"
+
+    def arrest(self):
+        """
+        Arrest a random active citizen within vision, if any, and return it.
+        """
+        arrestee = self.choose_arrestee()
+        if arrestee is not None:
+            self.jail(arrestee)
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(ARRESTS)
+        return arrestee
+
+    def move_target(self):
+        """
+        A random empty cell (flat index) within vision, or None.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        target = random_empty_cell(self)
+        if profiler:
+            profiler.lap(NEIGHBORS)
+        return target
+
+    def move(self):
+        """
+        Move to a random empty cell within vision.
+        """
+        target = self.move_target()
+        if target is not None:
+            self.model.move_agent(self, self.model.neighborhoods.coordinates(target))
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(MOVEMENT)
+
+    def plan(self):
+        """
+        Pick this step's arrestee and destination from the state at the start
+        of the step (the compute phase of simultaneous updating).
+        """
+        self.arrestee = self.choose_arrestee()
+        profiler = self.model.profiler
+        if profiler:
+            profiler.lap(ARRESTS)
+        self.target = self.move_target() if self.model.movement else None
+
+    def commit_arrest(self):
+        """
+        Arrest the planned citizen unless another cop already has.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        arrestee, self.arrestee = self.arrestee, None
+        if arrestee is not None and arrestee.jail_sentence == 0:
+            self.jail(arrestee)
+        if profiler:
+            profiler.lap(ARRESTS)
+
+    def commit_move(self):
+        """
+        Move to the planned cell unless someone got there first.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        target, self.target = self.target, None
+        if target is not None and not self.model.neighborhoods.occupied[target]:
+            self.model.move_agent(self, self.model.neighborhoods.coordinates(target))
+        if profiler:
+            profiler.lap(MOVEMENT)
 
     def update_neighbors(self):
         """
         Look around and see who my neighbors are in a hexagonal grid.
         """
-        # Include_center=False to exclude the agent's own cell from the neighborhood
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos,
-            include_center=False,
-            radius=self.vision
-        )
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-        self.empty_neighbors = [
-            pos for pos in self.neighborhood if self.model.grid.is_cell_empty(pos)
-        ]
+        # the shared index leaves out the cop's own cell
+        neighborhoods = self.model.neighborhoods
+        self.neighbors = neighborhoods.neighbors(self.pos, self.vision)
+        self.neighbors_clock = neighborhoods.clock
+
+    def refresh_neighbors(self):
+        """
+        Reuse the last neighborhood snapshot unless an agent has moved into or
+        out of it since; neighbors' conditions and jail terms are read live,
+        so only occupancy changes invalidate the snapshot.
+        """
+        if self.neighbors_clock is None or not self.model.neighborhoods.unchanged_since(
+            self.pos, self.vision, self.neighbors_clock
+        ):
+            self.update_neighbors()
@@ -0,0 +1,161 @@
+import numpy as np
+
+# Columns of the per-cell aggregate table
+COPS = 0
+ACTIVE = 1
+JAILED = 2
+OCCUPIED = 3
+FREE_CITIZENS = 4
+GRIEVANCE = 5
+FIELDS = 6
+
+
+def contribution(agent):
+    """
+    What `agent` adds to the aggregates of every cell that can see it.
+    """
+    if agent.breed == "cop":
+        return (1, 0, 0, 1, 0, 0.0)
+    if agent.jail_sentence > 0:
+        return (0, 0, 1, 1, 0, 0.0)
+    active = 1 if agent.condition == "Active" else 0
+    return (0, active, 0, 1, 1, agent.grievance)
+
+
+class NeighborhoodAggregates:
+    """
+    Running per-cell totals over hex neighborhoods.
+
+    For every tracked vision v, row c of the table holds, over the cells
+    within v of cell c (excluding c itself), the number of cops, of free
+    Active citizens, of jailed citizens and of occupied cells, plus the count
+    and grievance sum of free citizens. Hex neighborhoods are symmetric, so an
+    agent standing on cell p contributes to exactly the rows of the cells in
+    p's own neighborhood, and any change to one agent is a single vectorised
+    update of those rows. Queries are plain lookups.
+
+    Agents report their changes through update() and move(); Citizen does so
+    from its condition, jail_sentence and grievance setters and the model
+    from move_agent().
+
+    After watch(vision), `changed` flags every cell whose counts of cops,
+    Active, jailed or occupied cells within `vision` have changed since the
+    flags were last cleared.
+    """
+
+    def __init__(self, neighborhoods, visions):
+        """
+        Create empty aggregates.
+        Args:
+            neighborhoods: the model's HexNeighborhoodIndex
+            visions: neighborhood radii to keep totals for
+        """
+        self.neighborhoods = neighborhoods
+        n_cells = neighborhoods.width * neighborhoods.height
+        self.totals = {vision: np.zeros((n_cells, FIELDS)) for vision in set(visions)}
+        # the same contributions summed over the whole population
+        self.population = np.zeros(FIELDS)
+        self._contributions = {}
+        self.watched = self.changed = None
+
+    def watch(self, vision):
+        """
+        Start flagging changed cells for `vision`, with every cell flagged.
+        """
+        self.watched = vision
+        self.changed = np.ones(len(self.totals[vision]), dtype=bool)
+
+    def _apply(self, pos, delta):
+        self.population += delta
+        for vision, totals in self.totals.items():
+            cells = self.neighborhoods.cell_indices(pos, vision)
+            totals[cells] += delta
+            if vision == self.watched and any(delta[:FREE_CITIZENS]):
+                self.changed[cells] = True
+
+    def add(self, agent):
+        """
+        Start tracking an agent placed on the grid.
+        """
+        current = contribution(agent)
+        self._contributions[agent] = current
+        self._apply(agent.pos, current)
+
+    def add_all(self, agents):
+        """
+        Start tracking many agents at once, as add() for each but summing
+        the per-cell contributions over whole neighborhoods.
+        """
+        neighborhoods = self.neighborhoods
+        agents = list(agents)
+        if not agents:
+            return
+        contributions = [contribution(agent) for agent in agents]
+        self._contributions.update(zip(agents, contributions))
+        cells = [x * neighborhoods.height + y for x, y in (a.pos for a in agents)]
+        field = np.zeros((neighborhoods.width * neighborhoods.height, FIELDS))
+        field[cells] = contributions
+        self.population += field.sum(0)
+        for vision, totals in self.totals.items():
+            if neighborhoods.has_table(vision):
+                # neighborhoods are symmetric: a cell's total is the sum of
+                # its neighbors' contributions
+                totals += neighborhoods.sums(field, vision)
+            else:
+                for agent, cell in zip(agents, cells):
+                    totals[neighborhoods.cell_indices(agent.pos, vision)] += field[cell]
+
+    def update(self, agent):
+        """
+        Re-read the state of a tracked agent that has not moved.
+        """
+        previous = self._contributions.get(agent)
+        if previous is None:
+            return
+        current = contribution(agent)
+        if current != previous:
+            self._contributions[agent] = current
+            self._apply(agent.pos, np.subtract(current, previous))
+
+    def move(self, agent, old_pos, new_pos):
+        """
+        Shift a tracked agent's contribution from `old_pos` to `new_pos`.
+        """
+        current = self._contributions.get(agent)
+        if current is None:
+            return
+        self._apply(old_pos, np.negative(current))
+        self._apply(new_pos, current)
+
+    def tally(self):
+        """
+        Counts of free Quiescent and Active citizens, jailed citizens and
+        cops over the whole population.
+        """
+        cops, active, jailed, _, free, _ = self.population.astype(int).tolist()
+        return {
+            "Quiescent": free - active,
+            "Active": active,
+            "Jailed": jailed,
+            "Cops": cops,
+        }
+
+    def count(self, pos, vision, field):
+        """
+        Number of agents of kind `field` within `vision` of `pos`.
+        """
+        x, y = pos
+        return int(self.totals[vision][x * self.neighborhoods.height + y, field])
+
+    def has_empty_cell(self, pos, vision):
+        """
+        Whether any cell within `vision` of `pos` is empty.
+        """
+        return self.count(pos, vision, OCCUPIED) < self.neighborhoods.size(pos, vision)
+
+    def total(self, pos, vision, field):
+        """
+        Sum of `field` within `vision` of `pos`.
+        """
+        x, y = pos
+        return float(self.totals[vision][x * self.neighborhoods.height + y, field])
@@ -0,0 +1,314 @@
+"""
+Benchmarks of model construction and step throughput.
+
+Every case builds an EpsteinCivilViolence in a fresh process, times
+__init__, takes one untimed warm-up step, times the best of a few repeats of
+a number of steps, and records steps/sec, agent updates/sec and
+the peak memory the run added to the process. Cases vary one setting at a
+time around DEFAULTS (the "scaling" suite around a large tiled run instead,
+to see how the tiled engine's build and steps scale with grid size and
+process count). In the "ensemble" suite a case is `replicates` vectorized
+runs stepped as one Ensemble, also timed as separate models for the
+speedup. Results are written as JSON and can be compared with an earlier
+results file:
+
+    $ python -m epstein_civil_violence.benchmark --suite quick -o bench.json
+    $ python -m epstein_civil_violence.benchmark --suite quick --baseline bench.json
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import warnings
+
+from .scheduling import SCHEDULE_TYPES
+
+DEFAULTS = {
+    "width": 100,
+    "height": 100,
+    "citizen_density": 0.7,
+    "cop_density": 0.074,
+    "citizen_vision": 7,
+    "cop_vision": 7,
+    "movement": True,
+    "engine": "agents",
+    "schedule_type": "Random",
+    "max_iters": 10**9,
+    "seed": 0,
+}
+
+# per suite, the settings its cases start from instead of DEFAULTS
+SUITE_DEFAULTS = {
+    "scaling": {
+        "width": 1000,
+        "height": 1000,
+        "engine": "tiled",
+        "schedule_type": "Simultaneous",
+        "tiles": (4, 4),
+    },
+    "ensemble": {
+        "width": 20,
+        "height": 20,
+        "citizen_vision": 2,
+        "cop_vision": 2,
+        "engine": "vectorized",
+        "replicates": 50,
+    },
+}
+
+# setting name -> values tried, per suite; "density" sets both densities
+SUITES = {
+    "quick": {
+        "size": (40, 100),
+        "vision": (1, 7),
+        "movement": (False, True),
+        "engine": ("agents", "vectorized"),
+        "schedule_type": SCHEDULE_TYPES,
+    },
+    "full": {
+        "size": (40, 100, 200, 500),
+        "vision": (1, 3, 5, 7, 10),
+        "density": ((0.5, 0.04), (0.7, 0.074), (0.85, 0.1)),
+        "movement": (False, True),
+        "engine": ("agents", "vectorized"),
+        "schedule_type": SCHEDULE_TYPES,
+    },
+    "scaling": {
+        "size": (500, 1000, 2000),
+        "processes": (1, 2, 4, 8, 16),
+    },
+    "ensemble": {
+        "replicates": (10, 50, 200),
+        "size": (20, 40),
+        "vision": (2, 7),
+    },
+}
+
+
+def make_cases(suite):
+    """
+    Named parameter sets of a suite: its defaults with one setting changed.
+    """
+    cases = {}
+    for setting, values in SUITES[suite].items():
+        for value in values:
+            params = dict(DEFAULTS, **SUITE_DEFAULTS.get(suite, {}))
+            if setting == "size":
+                params["width"] = params["height"] = value
+            elif setting == "vision":
+                params["citizen_vision"] = params["cop_vision"] = value
+            elif setting == "density":
+                params["citizen_density"], params["cop_density"] = value
+            else:
+                params[setting] = value
+            if isinstance(value, tuple):
+                value = "/".join(map(str, value))
+            name = f"{setting}={value}"
+            cases[name] = params
+    return cases
+
+
+def _peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_case(params, steps, repeats=3):
+    """
+    Time one case; meant to run in a fresh process so the memory peak is
+    its own.
+    """
+    warnings.filterwarnings("ignore")
+    from .model import EpsteinCivilViolence
+
+    if "replicates" in params:
+        return run_ensemble_case(params, steps, repeats)
+    memory_before = _peak_memory_mb()
+    start = time.perf_counter()
+    model = EpsteinCivilViolence(**params)
+    init_seconds = time.perf_counter() - start
+    n_agents = len(model.schedule.agents)
+    model.step()
+    step_seconds = _time_steps(model.step, steps, repeats)
+    model.close()
+    return {
+        "params": params,
+        "agents": n_agents,
+        "steps": steps,
+        "repeats": repeats,
+        "init_seconds": init_seconds,
+        "step_seconds": step_seconds,
+        "steps_per_second": 1 / step_seconds,
+        "agent_updates_per_second": n_agents / step_seconds,
+        "peak_memory_mb": _peak_memory_mb() - memory_before,
+    }
+
+
+def _time_steps(step, steps, repeats):
+    """
+    Seconds per call of `step`, best of `repeats` runs of `steps` calls.
+    """
+    seconds = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(steps):
+            step()
+        seconds = min(seconds, (time.perf_counter() - start) / steps)
+    return seconds
+
+
+def run_ensemble_case(params, steps, repeats=3):
+    """
+    Time `replicates` runs stepped as one Ensemble, then the same runs as
+    separate models; init and step times are the ensemble's, and speedup
+    compares build plus steps of the two.
+    """
+    from .ensemble import Ensemble
+    from .model import EpsteinCivilViolence
+
+    params = dict(params)
+    first = params.pop("seed")
+    seeds = list(range(first, first + params.pop("replicates")))
+    memory_before = _peak_memory_mb()
+    start = time.perf_counter()
+    ensemble = Ensemble(seeds=seeds, **params)
+    init_seconds = time.perf_counter() - start
+    n_agents = len(ensemble.engine.breed)
+    ensemble.step()
+    step_seconds = _time_steps(ensemble.step, steps, repeats)
+    peak_memory_mb = _peak_memory_mb() - memory_before
+
+    start = time.perf_counter()
+    models = [EpsteinCivilViolence(seed=seed, **params) for seed in seeds]
+    separate_init_seconds = time.perf_counter() - start
+    for model in models:
+        model.step()
+
+    def step_all():
+        for model in models:
+            model.step()
+
+    separate_step_seconds = _time_steps(step_all, steps, repeats)
+    total = init_seconds + steps * step_seconds
+    separate = separate_init_seconds + steps * separate_step_seconds
+    return {
+        "params": dict(params, seed=first, replicates=len(seeds)),
+        "agents": n_agents,
+        "steps": steps,
+        "repeats": repeats,
+        "init_seconds": init_seconds,
+        "step_seconds": step_seconds,
+        "steps_per_second": 1 / step_seconds,
+        "agent_updates_per_second": n_agents / step_seconds,
+        "peak_memory_mb": peak_memory_mb,
+        "separate_init_seconds": separate_init_seconds,
+        "separate_step_seconds": separate_step_seconds,
+        "speedup": separate / total,
+    }
+
+
+def run_suite(suite="quick", steps=5, repeats=3, cases=None):
+    """
+    Run every case of a suite, one fresh process per case.
+    Args:
+        suite: name of an entry in SUITES
+        steps: timed steps per repeat
+        repeats: timed repeats per case; the fastest counts
+        cases: optional list of case names to restrict the run to
+    Returns:
+        dict of case name to result
+    """
+    selected = make_cases(suite)
+    if cases:
+        selected = {name: selected[name] for name in cases}
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name, params in selected.items():
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+            results[name] = pool.submit(run_case, params, steps, repeats).result()
+        result = results[name]
+        speedup = result.get("speedup")
+        print(
+            f"{name:24} {result['agents']:7d} agents  "
+            f"init {result['init_seconds']:7.3f}s  "
+            f"{result['steps_per_second']:9.2f} steps/s  "
+            f"{result['agent_updates_per_second']:12.0f} updates/s  "
+            f"{result['peak_memory_mb']:8.1f} MB"
+            + ("" if speedup is None else f"  x{speedup:.2f} vs separate"),
+            flush=True,
+        )
+    return results
+
+
+def compare(results, baseline, tolerance=0.15):
+    """
+    Compare results with a baseline run case by case.
+    Args:
+        results: dict of case name to result, as from run_suite
+        baseline: the same for the reference run
+        tolerance: relative slowdown or memory growth reported as a
+            regression
+    Returns:
+        list of (case, metric, baseline value, new value) regressions
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in (
+            ("steps_per_second", True),
+            ("init_seconds", False),
+            ("peak_memory_mb", False),
+        ):
+            old, new = reference[metric], result[metric]
+            ratio = new / old if old else 1.0
+            print(f"{name:24} {metric:18} {old:10.3f} -> {new:10.3f}  x{ratio:.2f}")
+            worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+            # tiny memory deltas are dominated by allocator noise
+            if worse and not (metric == "peak_memory_mb" and new - old < 5):
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--case", action="append", help="run only this case")
+    parser.add_argument("-o", "--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.suite, args.steps, args.repeats, args.case)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "suite": args.suite,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.3f} -> {new:.3f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+
+from .model import EpsteinCivilViolence
+
+# bytes kept on disk before the least recently used entries are evicted
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# the modules whose code decides what a run produces; editing any other
+# (visualization, command line, benchmarks, ...) keeps cached results valid
+SIMULATION_MODULES = (
+    "agent.py",
+    "aggregates.py",
+    "convergence.py",
+    "ensemble.py",
+    "model.py",
+    "neighborhood.py",
+    "scheduling.py",
+    "sweep.py",
+    "tiled.py",
+    "vectorized.py",
+)
+
+# parameters that only add outputs (files, timings) next to a run's rows:
+# they are left out of the key, and runs asking for them bypass the cache
+OUTPUT_PARAMETERS = ("columnar_output", "columnar_format", "profile", "profile_columns")
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of the source of SIMULATION_MODULES; editing the model invalidates
+    every cached result.
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in SIMULATION_MODULES:
+        digest.update(name.encode())
+        with open(os.path.join(package, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def model_parameters(kwargs):
+    """
+    The complete EpsteinCivilViolence parameter set of a run: `kwargs` with
+    every omitted parameter filled in with its default.
+    """
+    bound = inspect.signature(EpsteinCivilViolence.__init__).bind(None, **kwargs)
+    bound.apply_defaults()
+    parameters = dict(bound.arguments)
+    del parameters["self"]
+    return parameters
+
+
+def writes_outputs(kwargs):
+    """
+    Whether a run asks for outputs a cache hit would not produce: columnar
+    files or phase timings.
+    """
+    parameters = model_parameters(kwargs)
+    return bool(
+        parameters["columnar_output"] is not None
+        or parameters["profile"]
+        or parameters["profile_columns"]
+    )
+
+
+def run_key(kwargs, max_steps, data_collection_period):
+    """
+    Cache key of a run, or None when it has no seed and so cannot be
+    reproduced. OUTPUT_PARAMETERS are not part of it.
+    """
+    parameters = model_parameters(kwargs)
+    if parameters["seed"] is None:
+        return None
+    for name in OUTPUT_PARAMETERS:
+        del parameters[name]
+    description = json.dumps(
+        {
+            "parameters": parameters,
+            "max_steps": max_steps,
+            "data_collection_period": data_collection_period,
+            "version": code_version(),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of run results (the rows of sweep.run_job), one JSON file
+    per run in `directory`.
+
+    Runs are keyed by their full parameter set (defaults included, output
+    parameters excluded), seed, max_steps, collection period and
+    code_version(). The total size is kept under `max_bytes` by evicting the
+    least recently used entries; a hit refreshes the entry's modification
+    time, which serves as its last use.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Open (or create) a cache.
+        Args:
+            directory: where entries are stored
+            max_bytes: size bound of the cache on disk
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # bytes on disk, counted on the first put and tracked from then on
+        self._size = None
+
+    def _entries(self):
+        """
+        (modification time, size, name) of every entry.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        The cached rows for `key`, or None.
+        """
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                rows = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return rows
+
+    def put(self, key, rows):
+        """
+        Store the rows of a run and evict old entries if over the bound.
+        The directory is only listed again once the tracked size passes the
+        bound, so a sweep's puts cost no more as the cache grows.
+        """
+        if key is None:
+            return
+        if self._size is None:
+            self._size = sum(entry[1] for entry in self._entries())
+        path = self._path(key)
+        try:
+            self._size -= os.path.getsize(path)
+        except OSError:
+            pass
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(rows, f, default=str)
+        self._size += os.path.getsize(temporary)
+        os.replace(temporary, path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits max_bytes.
+        """
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+        self._size = size
@@ -0,0 +1,215 @@
+import pickle
+
+import numpy as np
+
+from .agent import CONDITIONS, Citizen, Cop
+from .columnar import ColumnarCollector
+from .model import EpsteinCivilViolence
+from .scheduling import make_schedule
+from .vectorized import COP
+
+# parameters a restored run cannot change: the agents' positions depend on
+# them
+FIXED = ("width", "height")
+
+
+def agent_state(model):
+    """
+    Every agent's state as arrays, in schedule order. Cops carry zeros in
+    the citizen-only columns.
+    """
+    engine = model.vectorized
+    if engine is not None:
+        return {
+            "unique_id": np.array([agent.unique_id for agent in engine.agents]),
+            "breed": engine.breed.copy(),
+            "position": engine.position.copy(),
+            "hardship": engine.hardship.copy(),
+            "regime_legitimacy": engine.regime_legitimacy.copy(),
+            "risk_aversion": engine.risk_aversion.copy(),
+            "grievance": engine.grievance.copy(),
+            "condition": engine.condition.copy(),
+            "jail_sentence": engine.jail_sentence.copy(),
+            "arrest_probability": engine.arrest_probability.copy(),
+        }
+    agents = model.schedule.agents
+    n = len(agents)
+    state = {
+        "unique_id": np.empty(n, dtype=np.int64),
+        "breed": np.zeros(n, dtype=np.int8),
+        "position": np.empty(n, dtype=np.int64),
+        "hardship": np.zeros(n),
+        "regime_legitimacy": np.zeros(n),
+        "risk_aversion": np.zeros(n),
+        "grievance": np.zeros(n),
+        "condition": np.zeros(n, dtype=np.int8),
+        "jail_sentence": np.zeros(n, dtype=np.int64),
+        "arrest_probability": np.full(n, np.nan),
+    }
+    for i, agent in enumerate(agents):
+        x, y = agent.pos
+        state["unique_id"][i] = agent.unique_id
+        state["position"][i] = x * model.height + y
+        state["breed"][i] = agent.breed_code
+        if agent.breed == "cop":
+            continue
+        state["hardship"][i] = agent.hardship
+        state["regime_legitimacy"][i] = agent.regime_legitimacy
+        state["risk_aversion"][i] = agent.risk_aversion
+        state["grievance"][i] = agent.grievance
+        state["condition"][i] = agent.condition_code
+        state["jail_sentence"][i] = agent.jail_sentence
+        if agent.arrest_probability is not None:
+            state["arrest_probability"][i] = agent.arrest_probability
+    return state
+
+
+def snapshot(model):
+    """
+    Capture the full state of a model: its parameters, clock, agents (in
+    schedule order), both random number generators, the collected series,
+    the steady-state detector's history, the neighborhood aggregates and
+    which citizens the active-set schedule has yet to revisit.
+    """
+    detector = model.steady_state
+    aggregates = model.aggregates
+    return {
+        "parameters": dict(model.parameters),
+        "iteration": model.iteration,
+        "aid_applied": model.aid_applied,
+        "steps": model.schedule.steps,
+        "time": model.schedule.time,
+        "running": model.running,
+        "stop_reason": model.stop_reason,
+        "agents": agent_state(model),
+        "random": model.random.getstate(),
+        "rng": model.rng.bit_generator.state,
+        "model_vars": {
+            name: list(values)
+            for name, values in model.datacollector.model_vars.items()
+        },
+        "steady_state": None
+        if detector is None
+        else (list(detector.history), list(detector.hashes), detector.reason),
+        # the running grievance sums carry the rounding of every update so
+        # far; recomputing them would shift the continued run in the last bits
+        "aggregates": None
+        if aggregates is None
+        else (
+            {vision: totals.copy() for vision, totals in aggregates.totals.items()},
+            aggregates.population.copy(),
+        ),
+        "changed": None
+        if aggregates is None or aggregates.changed is None
+        else aggregates.changed.copy(),
+        "woken": [
+            citizen.unique_id for citizen in getattr(model.schedule, "woken", ())
+        ],
+    }
+
+
+def _load_agents(model, state):
+    for agent in model.schedule.agents:
+        model.grid.remove_agent(agent)
+    model.neighborhoods.occupied[:] = False
+    model.schedule = make_schedule(model, model.schedule_type)
+    if model.engine == "tiled":
+        model.vectorized.close()
+    model.aggregates = model.vectorized = None
+    for i, unique_id in enumerate(state["unique_id"].tolist()):
+        pos = divmod(int(state["position"][i]), model.height)
+        if state["breed"][i] == COP:
+            agent = Cop(unique_id, model, pos, vision=model.cop_vision)
+        else:
+            agent = Citizen(
+                unique_id,
+                model,
+                pos,
+                hardship=float(state["hardship"][i]),
+                regime_legitimacy=float(state["regime_legitimacy"][i]),
+                risk_aversion=float(state["risk_aversion"][i]),
+                threshold=model.active_threshold,
+                vision=model.citizen_vision,
+            )
+            agent.grievance = float(state["grievance"][i])
+            agent.condition = CONDITIONS[state["condition"][i]]
+            agent.jail_sentence = int(state["jail_sentence"][i])
+            if not np.isnan(state["arrest_probability"][i]):
+                agent.arrest_probability = float(state["arrest_probability"][i])
+        model.grid.place_agent(agent, pos)
+        model.schedule.add(agent)
+    model.build_engine()
+
+
+def restore(state, **overrides):
+    """
+    Rebuild a model from a snapshot, ready to continue exactly where the
+    original left off.
+
+    Keyword arguments override the saved parameters, which forks the run:
+    e.g. restore(state, international_aid="Aid Government", shock_amount=0.1)
+    continues the saved prefix under a different aid scenario. The random
+    number generators resume from their saved state unless `seed` is
+    overridden. Overriding the grid size is not supported.
+    """
+    parameters = dict(state["parameters"])
+    parameters.update(overrides)
+    for name in FIXED:
+        if parameters[name] != state["parameters"][name]:
+            raise ValueError(f"Cannot change {name} of a restored run")
+    columnar_output = parameters.pop("columnar_output")
+    model = EpsteinCivilViolence(columnar_output=None, **parameters)
+    _load_agents(model, state["agents"])
+    model.iteration = state["iteration"]
+    model.aid_applied = state["aid_applied"]
+    model.schedule.steps = state["steps"]
+    model.schedule.time = state["time"]
+    model.running = state["running"]
+    model.stop_reason = state["stop_reason"]
+    if "seed" not in overrides:
+        model.random.setstate(state["random"])
+        model.rng.bit_generator.state = state["rng"]
+    model.datacollector.model_vars = {
+        name: list(values) for name, values in state["model_vars"].items()
+    }
+    if model.steady_state is not None and state["steady_state"] is not None:
+        history, hashes, reason = state["steady_state"]
+        model.steady_state.history.extend(history)
+        model.steady_state.hashes.extend(hashes)
+        model.steady_state.reason = reason
+    if state.get("aggregates") is not None and model.aggregates is not None:
+        totals, population = state["aggregates"]
+        # overridden visions keep the totals just built
+        if totals.keys() == model.aggregates.totals.keys():
+            for vision, values in totals.items():
+                model.aggregates.totals[vision][:] = values
+            model.aggregates.population[:] = population
+    # snapshots from before the active-set schedule lack these
+    if state.get("changed") is not None and model.aggregates.changed is not None:
+        model.aggregates.changed[:] = state["changed"]
+    if state.get("woken"):
+        agents = {agent.unique_id: agent for agent in model.schedule.agents}
+        model.schedule.woken = [agents[unique_id] for unique_id in state["woken"]]
+    model.counts = model.tally()
+    model.parameters["columnar_output"] = columnar_output
+    if columnar_output is not None:
+        model.columnar = ColumnarCollector(
+            model, columnar_output, parameters["columnar_format"]
+        )
+    return model
+
+
+def save(model, path):
+    """
+    Write a snapshot of `model` to `path`.
+    """
+    with open(path, "wb") as f:
+        pickle.dump(snapshot(model), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load(path, **overrides):
+    """
+    Restore a model saved with save(); see restore() for `overrides`.
+    """
+    with open(path, "rb") as f:
+        return restore(pickle.load(f), **overrides)
@@ -0,0 +1,226 @@
+"""
+Headless command-line runner: one EpsteinCivilViolence run, no visualization.
+
+Every model parameter is an option named after it, and the
+Quiescent/Active/Jailed counts of the run are written as CSV, JSON or
+Parquet, to a file or standard output:
+
+    $ python -m epstein_civil_violence.cli --width 40 --height 40 --seed 1 \\
+        --max-iters 200 --international-aid "Aid Rebellion" -o run.csv
+
+mesa's package imports its visualization server (Tornado), pandas for
+DataCollector dataframes and networkx for network grids, none of which a
+headless run touches. They are loaded lazily: the module objects exist but
+their code only runs if an attribute is used, which brings a worker's
+import time down from about 0.8s to about 0.1s. --timing reports the
+import, build and run seconds on standard error.
+"""
+import argparse
+import ast
+import csv
+import importlib.machinery
+import importlib.util
+import inspect
+import json
+import sys
+import time
+
+FORMATS = ("csv", "json", "parquet")
+
+# imported by mesa's package but unused by a headless run
+DEFERRED = ("mesa.visualization", "pandas", "networkx")
+
+# help for the model options that need more than their default
+PARAMETER_HELP = {
+    "engine": "agents, vectorized or tiled; vectorized and tiled need an even "
+    "--width and at least 2 * vision + 1 cells in each direction",
+}
+
+
+class LazyImportFinder:
+    """
+    Meta path finder that loads the named modules lazily: importing one
+    creates its module without executing it, and the first attribute access
+    executes it (see importlib.util.LazyLoader).
+    """
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+
+    def find_spec(self, name, path=None, target=None):
+        if name not in self.names:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is None or not hasattr(spec.loader, "exec_module"):
+            return None
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        return spec
+
+
+def defer_imports(names=DEFERRED):
+    """
+    Make later imports of `names` lazy; modules already imported are left as
+    they are.
+    """
+    sys.meta_path.insert(0, LazyImportFinder(names))
+
+
+def _literal(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError(f"not a Python literal: {text!r}")
+
+
+def _boolean(text):
+    if text.lower() in ("1", "true", "yes", "on"):
+        return True
+    if text.lower() in ("0", "false", "no", "off"):
+        return False
+    raise argparse.ArgumentTypeError(f"not a boolean: {text!r}")
+
+
+# types of the model options whose default (None) does not tell; any other
+# such option is taken as a string
+PARAMETER_TYPES = {"tiles": _literal, "processes": int, "seed": int}
+
+
+def add_model_arguments(parser, model_class):
+    """
+    Add an option per model parameter, typed by its default, or by
+    PARAMETER_TYPES when that is None: e.g. --citizen-density 0.7,
+    --movement false, --tiles "(2, 2)". Paths such as --columnar-output
+    stay strings, however they look.
+    """
+    group = parser.add_argument_group("model parameters")
+    for name, parameter in inspect.signature(model_class.__init__).parameters.items():
+        if name == "self":
+            continue
+        default = parameter.default
+        if isinstance(default, bool):
+            kind = _boolean
+        elif isinstance(default, (int, float, str)):
+            kind = type(default)
+        else:
+            kind = PARAMETER_TYPES.get(name, str)
+        group.add_argument(
+            "--" + name.replace("_", "-"),
+            dest=name,
+            type=kind,
+            default=argparse.SUPPRESS,
+            help=" ".join(
+                filter(None, (PARAMETER_HELP.get(name), f"(default: {default!r})"))
+            ),
+        )
+
+
+def run(model, max_steps=None, every=1):
+    """
+    Run `model` to the end, or for at most `max_steps` steps, without
+    keeping its DataCollector history.
+    Returns:
+        list of (step, quiescent, active, jailed) every `every` steps, the
+        initial state and the last step included
+    """
+    rows = []
+
+    def keep(step, counts):
+        rows.append((step, counts["Quiescent"], counts["Active"], counts["Jailed"]))
+
+    keep(model.schedule.steps, model.counts)
+    record = None
+    for record in model.iter_steps(max_steps, keep_history=False):
+        if every > 0 and record.step % every == 0:
+            keep(record.step, record.counts)
+    if record is not None and rows[-1][0] != record.step:
+        keep(record.step, record.counts)
+    return rows
+
+
+def write(rows, output, form, info):
+    """
+    Write the rows in format `form` to the path `output` ("-" for standard
+    output); JSON also carries `info`.
+    """
+    columns = ("Step", "Quiescent", "Active", "Jailed")
+    series = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+    if form == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table(series), output)
+        return
+    f = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        if form == "json":
+            json.dump(dict(info, series=series), f, default=str)
+            f.write("\n")
+        else:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    defer_imports()
+    from .model import EpsteinCivilViolence
+
+    imported = time.perf_counter()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", default="-", help="path, - for stdout")
+    parser.add_argument(
+        "-f", "--format", choices=FORMATS, help="default: by extension, else csv"
+    )
+    parser.add_argument("--max-steps", type=int, help="stop after this many steps")
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=1,
+        help="write every n-th step; 0 writes only the first and last",
+    )
+    parser.add_argument(
+        "--timing", action="store_true", help="report seconds spent on stderr"
+    )
+    add_model_arguments(parser, EpsteinCivilViolence)
+    args = vars(parser.parse_args(argv))
+    output = args.pop("output")
+    form = args.pop("format")
+    if form is None:
+        form = next((f for f in FORMATS if output.endswith("." + f)), "csv")
+    if form == "parquet" and output == "-":
+        parser.error("Parquet output needs a file, pass -o")
+    max_steps = args.pop("max_steps")
+    every = args.pop("every")
+    timing = args.pop("timing")
+
+    try:
+        model = EpsteinCivilViolence(**args)
+    except ValueError as error:
+        parser.error(str(error))
+    with model:
+        built = time.perf_counter()
+        rows = run(model, max_steps, every)
+        finished = time.perf_counter()
+        if model.running:
+            model.stop("max_steps")
+    info = {
+        "parameters": model.parameters,
+        "steps": model.schedule.steps,
+        "stop_reason": model.stop_reason,
+    }
+    write(rows, output, form, info)
+    if timing:
+        print(
+            f"import {imported - start:.3f}s  build {built - imported:.3f}s  "
+            f"run {finished - built:.3f}s  ({model.schedule.steps} steps)",
+            file=sys.stderr,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
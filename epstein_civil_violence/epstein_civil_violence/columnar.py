@@ -0,0 +1,239 @@
+import os
+
+import numpy as np
+
+from .agent import BREEDS, CONDITIONS
+from .vectorized import COP
+
+FORMATS = ("parquet", "arrow")
+
+
+class ColumnBuffer:
+    """
+    Growable set of typed NumPy columns with an optional null mask each.
+    """
+
+    def __init__(self, dtypes, capacity):
+        self.dtypes = dtypes
+        self.capacity = capacity
+        self.columns = {name: np.empty(capacity, dtype) for name, dtype in dtypes.items()}
+        self.nulls = {name: np.zeros(capacity, dtype=bool) for name in dtypes}
+        self.size = 0
+
+    def reserve(self, rows):
+        needed = self.size + rows
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, 2 * self.capacity)
+        for name in self.dtypes:
+            self.columns[name] = np.resize(self.columns[name], capacity)
+            self.nulls[name] = np.resize(self.nulls[name], capacity)
+        self.capacity = capacity
+
+    def append(self, values, nulls=None):
+        """
+        Append equal-length arrays (or scalars, broadcast to that length).
+        """
+        rows = max(np.size(v) for v in values.values())
+        self.reserve(rows)
+        start, stop = self.size, self.size + rows
+        for name, value in values.items():
+            self.columns[name][start:stop] = value
+            self.nulls[name][start:stop] = False if nulls is None else nulls.get(name, False)
+        self.size = stop
+
+    def take(self):
+        """
+        Return the filled part of every column and empty the buffer.
+        """
+        columns = {name: column[: self.size].copy() for name, column in self.columns.items()}
+        nulls = {name: null[: self.size].copy() for name, null in self.nulls.items()}
+        self.size = 0
+        return columns, nulls
+
+
+class ColumnarCollector:
+    """
+    Collects model and agent time series into typed column buffers and
+    flushes them in chunks to Parquet or Arrow IPC files.
+
+    Model rows hold the step and the model reporters of the model's
+    DataCollector. Agent rows hold step, agent id, x, y, breed,
+    jail_sentence, condition and arrest_probability; breed and condition are
+    dictionary-encoded (categorical) and the citizen-only columns are null
+    for cops. Both tables load straight into pandas with pd.read_parquet or
+    pd.read_feather once the model has stopped or been closed (model.close(),
+    or `with EpsteinCivilViolence(...) as model:`); sweeps, iter_steps and the
+    command-line runner close it themselves.
+
+    Requires pyarrow.
+    """
+
+    def __init__(
+        self,
+        model,
+        directory,
+        file_format="parquet",
+        agents=True,
+        chunk_rows=1_000_000,
+    ):
+        """
+        Create a new collector.
+        Args:
+            model: EpsteinCivilViolence instance
+            directory: where model.<ext> and agents.<ext> are written
+            file_format: "parquet" or "arrow" (Arrow IPC file)
+            agents: whether to record agent-level rows
+            chunk_rows: buffered agent rows that trigger a flush
+        """
+        if file_format not in FORMATS:
+            raise ValueError("Invalid file format, choose 'parquet' or 'arrow'")
+        import pyarrow  # noqa: F401  fail early if the optional dependency is missing
+
+        self.model = model
+        self.directory = directory
+        self.file_format = file_format
+        self.agents = agents
+        self.chunk_rows = chunk_rows
+        os.makedirs(directory, exist_ok=True)
+        # model reporter dtypes are taken from their first values
+        self.model_buffer = None
+        self.agent_buffer = ColumnBuffer(
+            {
+                "Step": np.int32,
+                "AgentID": np.int64,
+                "x": np.int32,
+                "y": np.int32,
+                "breed": np.int8,
+                "jail_sentence": np.int32,
+                "condition": np.int8,
+                "arrest_probability": np.float32,
+            },
+            min(chunk_rows, 1 << 16),
+        )
+        self._writers = {}
+
+    def collect(self):
+        """
+        Record the current step; call after model.datacollector.collect().
+        """
+        step = self.model.schedule.steps
+        row = {name: values[-1] for name, values in self.model.datacollector.model_vars.items()}
+        if self.model_buffer is None:
+            dtypes = {name: np.asarray(value).dtype for name, value in row.items()}
+            self.model_buffer = ColumnBuffer(dict(Step=np.int32, **dtypes), 1024)
+        self.model_buffer.append(dict(Step=step, **row))
+        if self.agents:
+            values, nulls = self.agent_columns()
+            values["Step"] = step
+            self.agent_buffer.append(values, nulls)
+            if self.agent_buffer.size >= self.chunk_rows:
+                self.flush()
+
+    def agent_columns(self):
+        """
+        Current agent state as typed arrays plus null masks.
+        """
+        engine = self.model.vectorized
+        if engine is not None:
+            if not hasattr(self, "_agent_ids"):
+                self._agent_ids = np.array([a.unique_id for a in engine.agents])
+            x, y = np.divmod(engine.position, engine.height)
+            is_cop = engine.breed == COP
+            values = {
+                "AgentID": self._agent_ids,
+                "x": x,
+                "y": y,
+                "breed": engine.breed,
+                "jail_sentence": engine.jail_sentence,
+                "condition": engine.condition,
+                "arrest_probability": np.nan_to_num(engine.arrest_probability),
+            }
+            probability_null = is_cop | np.isnan(engine.arrest_probability)
+        else:
+            agents = self.model.schedule.agents
+            n = len(agents)
+            values = {
+                "AgentID": np.empty(n, dtype=np.int64),
+                "x": np.empty(n, dtype=np.int32),
+                "y": np.empty(n, dtype=np.int32),
+                "breed": np.zeros(n, dtype=np.int8),
+                "jail_sentence": np.zeros(n, dtype=np.int32),
+                "condition": np.zeros(n, dtype=np.int8),
+                "arrest_probability": np.zeros(n, dtype=np.float32),
+            }
+            is_cop = np.zeros(n, dtype=bool)
+            probability_null = np.zeros(n, dtype=bool)
+            for i, agent in enumerate(agents):
+                values["AgentID"][i] = agent.unique_id
+                values["x"][i], values["y"][i] = agent.pos
+                if agent.breed == "cop":
+                    values["breed"][i] = COP
+                    is_cop[i] = probability_null[i] = True
+                    continue
+                values["jail_sentence"][i] = agent.jail_sentence
+                values["condition"][i] = agent.condition_code
+                if agent.arrest_probability is None:
+                    probability_null[i] = True
+                else:
+                    values["arrest_probability"][i] = agent.arrest_probability
+        nulls = {
+            "jail_sentence": is_cop,
+            "condition": is_cop,
+            "arrest_probability": probability_null,
+        }
+        return values, nulls
+
+    def _table(self, buffer, categories):
+        import pyarrow as pa
+
+        columns, nulls = buffer.take()
+        arrays = {}
+        for name, column in columns.items():
+            mask = nulls[name] if nulls[name].any() else None
+            array = pa.array(column, mask=mask)
+            if name in categories:
+                array = pa.DictionaryArray.from_arrays(array, pa.array(categories[name]))
+            arrays[name] = array
+        return pa.table(arrays)
+
+    def _write(self, name, table):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = self._writers.get(name)
+        if writer is None:
+            path = os.path.join(self.directory, f"{name}.{self.file_format}")
+            if self.file_format == "parquet":
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                writer = pa.ipc.new_file(path, table.schema)
+            self._writers[name] = writer
+        writer.write_table(table)
+
+    def flush(self):
+        """
+        Write the buffered rows out as one chunk per table.
+        """
+        if self.model_buffer is not None and self.model_buffer.size:
+            self._write("model", self._table(self.model_buffer, {}))
+        if self.agent_buffer.size:
+            categories = {"breed": BREEDS, "condition": CONDITIONS}
+            self._write("agents", self._table(self.agent_buffer, categories))
+
+    def close(self):
+        """
+        Flush the remaining rows and finalise the files; until then they
+        cannot be read. Usually called through model.close() or
+        model.stop().
+        """
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
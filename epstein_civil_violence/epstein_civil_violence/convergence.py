@@ -0,0 +1,82 @@
+import collections
+
+import numpy as np
+
+SERIES = ("Quiescent", "Active", "Jailed")
+
+
+class SteadyStateDetector:
+    """
+    Watches the Quiescent/Active/Jailed series (and optionally a hash of the
+    full agent state) and reports when a run has settled.
+
+    A run is settled when, over the last `window` steps,
+        - every series stays within `tolerance` of its range ("fixed point"),
+        - or every series repeats itself with some period p between 2 and
+          `max_period`, within `tolerance` ("periodic, period p"),
+        - or, with `use_state_hash`, the exact agent state (positions,
+          conditions and jail terms) repeats with some period p for a whole
+          cycle: each of the last p states equals the one p steps before it
+          ("state repeated, period p").
+    The tolerance is a fraction of the citizen population, so the same
+    setting works across grid sizes. The model calls reset() when the
+    international aid shock changes the dynamics, so the window only ever
+    holds steps under one regime.
+
+    Attributes:
+        reason: why the run was judged settled, None until then
+    """
+
+    def __init__(self, window=50, tolerance=0.01, max_period=20, use_state_hash=False):
+        """
+        Create a new detector.
+        Args:
+            window: number of recent steps that must agree
+            tolerance: allowed deviation, as a fraction of the citizens
+            max_period: longest cycle searched for; below 2 disables it
+            use_state_hash: also compare hashes of the full agent state
+        """
+        self.window = window
+        self.tolerance = tolerance
+        self.max_period = max_period
+        self.use_state_hash = use_state_hash
+        self.history = collections.deque(maxlen=window + max(max_period, 0))
+        self.hashes = collections.deque(maxlen=window)
+        self.reason = None
+
+    def reset(self):
+        """
+        Forget the steps seen so far.
+        """
+        self.history.clear()
+        self.hashes.clear()
+
+    def update(self, model):
+        """
+        Record the model's current counts; return True once it has settled.
+        """
+        counts = model.counts
+        self.history.append([counts[name] for name in SERIES])
+        if self.use_state_hash:
+            hashes = self.hashes
+            hashes.append(model.state_hash())
+            for period in range(1, len(hashes) // 2 + 1):
+                if all(hashes[-i] == hashes[-i - period] for i in range(1, period + 1)):
+                    self.reason = f"state repeated, period {period}"
+                    return True
+        if len(self.history) < self.window:
+            return False
+        history = np.array(self.history, dtype=float)
+        tolerance = self.tolerance * max(history[-1].sum(), 1)
+        recent = history[-self.window:]
+        if (recent.max(0) - recent.min(0)).max() <= tolerance:
+            self.reason = "fixed point"
+            return True
+        for period in range(2, self.max_period + 1):
+            if len(history) < self.window + period:
+                break
+            shifted = history[-self.window - period:-period]
+            if np.abs(recent - shifted).max() <= tolerance:
+                self.reason = f"periodic, period {period}"
+                return True
+        return False
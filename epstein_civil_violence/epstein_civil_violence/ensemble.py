@@ -0,0 +1,261 @@
+import numpy as np
+
+from .model import EpsteinCivilViolence
+from .vectorized import ACTIVE, EMPTY, VectorizedEngine
+
+# per-step series of Ensemble.series()
+SERIES = ("Quiescent", "Active", "Jailed")
+
+# per-agent arrays stacked from the replicates' engines
+FIELDS = (
+    "breed",
+    "position",
+    "hardship",
+    "regime_legitimacy",
+    "risk_aversion",
+    "grievance",
+    "condition",
+    "jail_sentence",
+    "arrest_probability",
+)
+
+# model settings a replicate cannot have: each one is a vectorized model
+# stepped with the others, to the end
+UNSUPPORTED = ("engine", "tiles", "processes", "columnar_output", "early_stop")
+
+
+class EnsembleEngine(VectorizedEngine):
+    """
+    VectorizedEngine over several replicates of one configuration at once.
+
+    The replicates' agents are stacked into one set of arrays and their
+    lattices laid side by side as one of R * width * height cells, replicate
+    r owning the r-th block of width * height. Neighbor lookups stay within a
+    replicate's block, so replicates never interact, while each batched
+    operation of a step covers all of them: a step takes the same number of
+    array operations however many replicates there are.
+
+    The engine's random numbers are counter-based, keyed per agent by its
+    replicate's seed (see VectorizedEngine.uniform), so the draws of all
+    replicates are made at once and each replicate still follows exactly
+    the run of a vectorized model with its seed on its own.
+
+    Attributes:
+        models: the replicates' models, whose engines' arrays were stacked
+        replicate: replicate index per agent
+        offsets: index of the first agent of each replicate, then the total
+    """
+
+    def __init__(self, models, batches=8):
+        """
+        Args:
+            models: EpsteinCivilViolence instances with engine="vectorized"
+                and the same parameters but for the seed
+            batches: number of activation groups per tick
+        """
+        model = models[0]
+        self.model = model
+        self.models = models
+        self.batches = batches
+        self.width = model.width
+        self.height = model.height
+        engines = [m.vectorized for m in models]
+        self.agents = [agent for engine in engines for agent in engine.agents]
+        sizes = [len(engine.breed) for engine in engines]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.replicate = np.repeat(np.arange(len(models)), sizes)
+        for name in FIELDS:
+            setattr(self, name, np.concatenate([getattr(e, name) for e in engines]))
+        self.position += self.replicate * (self.width * self.height)
+        self.keys = np.concatenate([engine.keys for engine in engines])
+        self.is_citizen = np.concatenate([engine.is_citizen for engine in engines])
+        self.is_cop = ~self.is_citizen
+        self.n_cells = len(models) * self.width * self.height
+        self.cell_agent = np.full(self.n_cells, EMPTY, dtype=np.int64)
+        self.cell_agent[self.position] = np.arange(len(self.breed))
+        self.cell_dtype = np.promote_types(
+            engines[0].citizen_table.dtype, np.min_scalar_type(self.n_cells)
+        )
+        self.citizen_table = engines[0].citizen_table
+        self.cop_table = engines[0].cop_table
+        self.draws_step = None
+        self.draws = {}
+
+    def activation_groups(self):
+        """
+        Group k of a tick is group k of every replicate's own activation
+        order, as VectorizedEngine.activation_groups() splits it.
+        """
+        agents = np.arange(len(self.breed))
+        if self.model.schedule_type == "Base":
+            order = agents
+        else:
+            order = np.lexsort((self.uniform(agents, "order"), self.replicate))
+        # rank of each agent of `order` within its replicate, and the group
+        # np.array_split puts that rank in
+        replicate = self.replicate[order]
+        rank = agents - self.offsets[replicate]
+        size = np.diff(self.offsets)[replicate]
+        small, extra = np.divmod(size, self.batches)
+        # the first `extra` groups take small + 1 agents, the rest small
+        head = extra * (small + 1)
+        group = np.where(
+            rank < head,
+            rank // (small + 1),
+            extra + (rank - head) // np.maximum(small, 1),
+        )
+        order = order[np.argsort(group, kind="stable")]
+        ends = np.cumsum(np.bincount(group, minlength=self.batches))
+        return np.split(order, ends[:-1])
+
+    def neighbors(self, table, cells):
+        """
+        The neighbor cells of each of `cells`, in the cell's own replicate.
+        """
+        local = cells % (self.width * self.height)
+        # in the table's own (narrow) dtype when the stacked lattice fits it
+        return table[:, local] + (cells - local).astype(self.cell_dtype)
+
+    def tallies(self):
+        """
+        Per-replicate counts of free Quiescent and Active citizens, jailed
+        citizens and cops, as arrays of length R; tally() sums them.
+        """
+        replicates = len(self.models)
+
+        def count(mask):
+            return np.bincount(self.replicate[mask], minlength=replicates)
+
+        free = self.free_citizens()
+        n_free = count(free)
+        active = count(free & (self.condition == ACTIVE))
+        n_citizens = count(self.is_citizen)
+        return {
+            "Quiescent": n_free - active,
+            "Active": active,
+            "Jailed": n_citizens - n_free,
+            "Cops": np.diff(self.offsets) - n_citizens,
+        }
+
+    def sync_agents(self):
+        """
+        Write each replicate's slice of the arrays back to its own model's
+        engine, Citizen/Cop objects and grid.
+        """
+        cells = self.width * self.height
+        for r, model in enumerate(self.models):
+            engine = model.vectorized
+            part = slice(self.offsets[r], self.offsets[r + 1])
+            for name in FIELDS:
+                getattr(engine, name)[:] = getattr(self, name)[part]
+            engine.position -= r * cells
+            engine.cell_agent[:] = EMPTY
+            engine.cell_agent[engine.position] = np.arange(len(engine.breed))
+            engine.sync_agents()
+
+
+class Ensemble:
+    """
+    Replicates of one EpsteinCivilViolence configuration, each with its own
+    seed and state, advanced in lockstep by an EnsembleEngine:
+
+        ensemble = Ensemble(replicates=100, seed=1, width=40, height=40)
+        series = ensemble.run(200)
+        series["Active"][-1]    # final Active count of every replicate
+
+    Many small replicates then cost a few large array operations per step
+    instead of a full interpreted model each. The replicates follow the
+    vectorized engine's updating and the model's clock: the international
+    aid shock hits at iteration 100 and the run ends after max_iters.
+    """
+
+    def __init__(self, replicates=10, seed=None, seeds=None, batches=8, **parameters):
+        """
+        Args:
+            replicates: number of replicates, unless `seeds` is given
+            seed: root seed; the replicates' seeds are spawned from it
+            seeds: the replicates' seeds, one per replicate
+            batches: activation groups per tick, see VectorizedEngine
+            parameters: EpsteinCivilViolence parameters shared by all
+                replicates; a replicate always uses the vectorized engine
+                and runs to max_iters, so the engine, tiled and columnar
+                settings and early_stop are not accepted, and the grid
+                must suit that engine (see EpsteinCivilViolence)
+        """
+        for name in UNSUPPORTED:
+            if parameters.get(name) not in (None, False, "vectorized"):
+                raise ValueError(f"Ensemble does not support {name}")
+        parameters["engine"] = "vectorized"
+        if seeds is None:
+            children = np.random.SeedSequence(seed).spawn(replicates)
+            seeds = [int(child.generate_state(1, np.uint64)[0]) for child in children]
+        self.seeds = list(seeds)
+        models = [EpsteinCivilViolence(seed=s, **parameters) for s in self.seeds]
+        self.engine = EnsembleEngine(models, batches=batches)
+        self.iteration = 0
+        self.aid_applied = False
+        self.running = True
+        self.history = {name: [] for name in SERIES}
+        self.collect()
+
+    @property
+    def models(self):
+        return self.engine.models
+
+    def step(self):
+        """
+        Advance every replicate by one step and record its counts.
+        """
+        model = self.models[0]
+        if not self.aid_applied and self.iteration == 100:
+            if model.international_aid == "Aid Government":
+                self.engine.adjust_legitimacy(model.shock_amount)
+            elif model.international_aid == "Aid Rebellion":
+                self.engine.adjust_legitimacy(-model.shock_amount)
+            self.aid_applied = True
+        self.engine.step()
+        for replicate in self.models:
+            # the step count names the engine's draws
+            replicate.schedule.steps += 1
+            replicate.schedule.time += 1
+        self.collect()
+        self.iteration += 1
+        if self.iteration > model.max_iters:
+            self.running = False
+
+    def run(self, max_steps=None):
+        """
+        Step until max_iters, or at most `max_steps` steps.
+        Returns:
+            series(), as for the whole run so far
+        """
+        taken = 0
+        while self.running and (max_steps is None or taken < max_steps):
+            self.step()
+            taken += 1
+        return self.series()
+
+    def collect(self):
+        counts = self.engine.tallies()
+        for name in SERIES:
+            self.history[name].append(counts[name])
+
+    def series(self):
+        """
+        Quiescent/Active/Jailed counts as arrays of shape (steps + 1, R):
+        row t holds every replicate's counts after t steps.
+        """
+        return {name: np.array(values) for name, values in self.history.items()}
+
+    def sync_models(self):
+        """
+        Bring every replicate's own model up to date with the ensemble, e.g.
+        to checkpoint, stream or visualize one replicate on its own.
+        """
+        self.engine.sync_agents()
+        for model in self.models:
+            model.iteration = self.iteration
+            model.aid_applied = self.aid_applied
+            model.schedule.steps = model.schedule.time = self.iteration
+            model.counts = model.tally()
+        return self.models
@@ -0,0 +1,231 @@
+import os
+import threading
+import webbrowser
+
+import numpy as np
+import tornado.escape
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+
+from .agent import Citizen
+from .model import EpsteinCivilViolence
+from .server import (
+    AGENT_QUIET_COLOR,
+    AGENT_REBEL_COLOR,
+    COP_COLOR,
+    JAIL_COLOR,
+    model_params,
+)
+from .vectorized import ACTIVE, COP
+
+# Per-cell codes sent to the browser
+EMPTY_CELL = 0
+QUIESCENT_CELL = 1
+ACTIVE_CELL = 2
+JAILED_CELL = 3
+COP_CELL = 4
+COLORS = ("#FFFFFF", AGENT_QUIET_COLOR, AGENT_REBEL_COLOR, JAIL_COLOR, COP_COLOR)
+
+# Frame header fields are little-endian uint32
+HEADER = np.dtype("<u4")
+
+
+def cell_codes(model):
+    """
+    What occupies every cell, as one uint8 code per flat cell index
+    (x * height + y).
+    """
+    codes = np.zeros(model.width * model.height, dtype=np.uint8)
+    engine = model.vectorized
+    if engine is not None:
+        state = np.where(engine.condition == ACTIVE, ACTIVE_CELL, QUIESCENT_CELL)
+        state[engine.jail_sentence > 0] = JAILED_CELL
+        state[engine.breed == COP] = COP_CELL
+        codes[engine.position] = state
+        return codes
+    for agent in model.schedule.agents:
+        x, y = agent.pos
+        if not isinstance(agent, Citizen):
+            code = COP_CELL
+        elif agent.jail_sentence:
+            code = JAILED_CELL
+        elif agent.condition == "Active":
+            code = ACTIVE_CELL
+        else:
+            code = QUIESCENT_CELL
+        codes[x * model.height + y] = code
+    return codes
+
+
+def encode_frame(step, counts, indices, codes, keyframe=False):
+    """
+    Binary frame: a little-endian uint32 header (keyframe flag, step, number
+    of changed cells, Quiescent, Active, Jailed), the changed cell indices as
+    uint32 and their new codes as uint8. A keyframe starts from an empty
+    grid and a new chart.
+    """
+    header = np.array(
+        [
+            keyframe,
+            step,
+            len(indices),
+            counts["Quiescent"],
+            counts["Active"],
+            counts["Jailed"],
+        ],
+        dtype=HEADER,
+    )
+    return header.tobytes() + indices.astype(HEADER).tobytes() + codes.tobytes()
+
+
+class Simulation(threading.Thread):
+    """
+    Steps the model in the background as fast as it can while running.
+    Readers take `lock` to see a consistent state between two steps.
+    """
+
+    def __init__(self, model_kwargs):
+        super().__init__(daemon=True)
+        self.model_kwargs = model_kwargs
+        self.lock = threading.Lock()
+        self.playing = threading.Event()
+        self.model = EpsteinCivilViolence(**model_kwargs)
+
+    def run(self):
+        while True:
+            self.playing.wait()
+            with self.lock:
+                if self.model.running:
+                    self.model.step()
+                else:
+                    self.playing.clear()
+
+    def reset(self):
+        with self.lock:
+            self.model = EpsteinCivilViolence(**self.model_kwargs)
+
+    def frame(self):
+        """
+        The current step, counts and cell codes.
+        """
+        with self.lock:
+            model = self.model
+            return model.schedule.steps, dict(model.counts), cell_codes(model)
+
+
+class PageHandler(tornado.web.RequestHandler):
+    def get(self):
+        model = self.application.simulation.model
+        self.render(
+            "live.html",
+            width=model.width,
+            height=model.height,
+            colors=tornado.escape.json_encode(COLORS),
+            max_fps=self.application.max_fps,
+        )
+
+
+class SocketHandler(tornado.websocket.WebSocketHandler):
+    """
+    One browser. Keeps the cell codes last sent to it, so every frame only
+    carries the cells that changed since; a browser that is still receiving
+    the previous frame skips frames instead of queueing them.
+    """
+
+    def open(self):
+        self.sent = None
+        self.pending = None
+        self.application.sockets.add(self)
+
+    def on_close(self):
+        self.application.sockets.discard(self)
+
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        simulation = self.application.simulation
+        if msg["type"] == "play":
+            simulation.playing.set()
+        elif msg["type"] == "pause":
+            simulation.playing.clear()
+        elif msg["type"] == "reset":
+            simulation.reset()
+            for socket in self.application.sockets:
+                socket.sent = None
+
+    def send_frame(self, step, counts, codes):
+        if self.pending is not None and not self.pending.done():
+            return
+        keyframe = self.sent is None
+        if keyframe:
+            self.sent = np.zeros_like(codes)
+        changed = np.flatnonzero(codes != self.sent)
+        self.sent = codes
+        try:
+            self.pending = self.write_message(
+                encode_frame(step, counts, changed, codes[changed], keyframe),
+                binary=True,
+            )
+        except tornado.websocket.WebSocketClosedError:
+            self.application.sockets.discard(self)
+
+
+class LiveServer(tornado.web.Application):
+    """
+    Visualization server that decouples simulation from rendering.
+
+    The model runs in a background thread at full speed. At most `max_fps`
+    times a second the server captures the grid as one byte per cell and
+    sends each browser a binary delta of the cells whose agent, condition or
+    jail state changed, instead of a JSON portrayal per agent. The page draws
+    the deltas onto a canvas and charts the counts carried in each frame.
+    """
+
+    def __init__(self, model_kwargs, max_fps=10, port=None):
+        """
+        Create a new server.
+        Args:
+            model_kwargs: EpsteinCivilViolence parameters; slider and choice
+                parameters contribute their current value
+            max_fps: cap on frames sent to each browser per second
+            port: port to listen on, defaults to $PORT or 8521
+        """
+        self.model_kwargs = {
+            name: getattr(value, "value", value) for name, value in model_kwargs.items()
+        }
+        self.max_fps = max_fps
+        self.port = port if port is not None else int(os.getenv("PORT", "8521"))
+        self.sockets = set()
+        self.simulation = Simulation(self.model_kwargs)
+        super().__init__(
+            [(r"/", PageHandler), (r"/ws", SocketHandler)],
+            template_path=os.path.join(os.path.dirname(__file__), "templates"),
+        )
+
+    def broadcast(self):
+        if not self.sockets:
+            return
+        step, counts, codes = self.simulation.frame()
+        for socket in list(self.sockets):
+            socket.send_frame(step, counts, codes)
+
+    def launch(self, open_browser=True):
+        """
+        Start the simulation thread and serve until interrupted.
+        """
+        url = f"http://127.0.0.1:{self.port}"
+        print(f"Interface starting at {url}")
+        self.listen(self.port)
+        self.simulation.start()
+        tornado.ioloop.PeriodicCallback(self.broadcast, 1000 / self.max_fps).start()
+        if open_browser:
+            webbrowser.open(url)
+        try:
+            tornado.ioloop.IOLoop.current().start()
+        except KeyboardInterrupt:
+            tornado.ioloop.IOLoop.current().stop()
+
+
+server = LiveServer(
+    dict(model_params, height=200, width=200, engine="vectorized"), max_fps=10
+)
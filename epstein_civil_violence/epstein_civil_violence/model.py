@@ -1,6 +1,16 @@
+import time
+
 import mesa
 import numpy as np
 from .agent import Citizen, Cop
+from .aggregates import NeighborhoodAggregates
+from .columnar import ColumnarCollector
+from .convergence import SteadyStateDetector
+from .neighborhood import HexNeighborhoodIndex
+from .profiling import COLLECT, GRIEVANCE, PHASES, SCHEDULE, PhaseProfiler
+from .scheduling import make_schedule, schedule_name
+from .tiled import TiledEngine
+from .vectorized import VectorizedEngine
 
 
 class EpsteinCivilViolence(mesa.Model):
@@ -27,6 +37,48 @@ class EpsteinCivilViolence(mesa.Model):
         movement: binary, whether agents try to move at step end
         max_iters: model may not have a natural stopping point, so we set a
             max.
+        engine: "agents" steps the Citizen/Cop objects through the mesa
+            schedule; "vectorized" steps the same population as NumPy arrays
+            (see VectorizedEngine); "tiled" splits the grid into tiles stepped
+            by worker processes over shared memory (see TiledEngine), for
+            very large grids. The tiled engine only runs the "Simultaneous"
+            schedule. Both array engines need an even width and at least
+            2 * max(citizen_vision, cop_vision) + 1 cells in each direction.
+        schedule_type: updating scheme, "Random" (agents act one at a time in
+            a new random order every step), "Base" (one at a time in a fixed
+            order), "Staged" (all citizens update, then all cops arrest, then
+            everyone moves) or "Simultaneous" (every agent plans from the
+            state at the start of the step, then all plans are committed) or
+            "ActiveSet" (as "Random", but only over the agents that can
+            change state; agents engine only, see ActiveSetActivation).
+            The mesa class names ("RandomActivation", ...) are accepted too.
+        tiles: (tiles across, tiles down) for the tiled engine; by default
+            about 250 cells a side (see default_tiles). The seed reproduces a
+            tiled run only with the same tiles; the process count does not
+            matter
+        processes: worker processes of the tiled engine, by default one per
+            CPU; 0 steps the tiles in the model's process
+        columnar_output: optional directory for model and agent time series
+            written by a ColumnarCollector (requires pyarrow)
+        columnar_format: "parquet" or "arrow"
+        early_stop: stop once the Quiescent/Active/Jailed series settle into
+            a fixed point or a cycle (see SteadyStateDetector); never before
+            a pending international aid shock
+        steady_state_window, steady_state_tolerance, steady_state_max_period,
+            steady_state_hash: SteadyStateDetector settings
+        stop_reason: why the run stopped ("max_iters" or the detector's
+            reason), None while running
+        seed: seed of the run; a fresh one is drawn when none is given. It
+            seeds both model.random and model.rng, the NumPy Generator behind
+            legitimacy, hardship, risk aversion, placement, activation order
+            and jail sentences (the vectorized engine hashes its step draws
+            from the seed instead), so the same seed reproduces a run
+            exactly.
+        profile: time the phases of every step (see PhaseProfiler); the
+            results are in model.profiler, which is None otherwise
+        profile_columns: also collect each phase's seconds in the step as
+            "<phase>_seconds" model reporters (all phases but collect, which
+            is still running when the reporters are read)
     """
 
     def __init__(
@@ -47,8 +99,33 @@ class EpsteinCivilViolence(mesa.Model):
         max_iters=1000,
         international_aid="No Aid",
         shock_amount=0.0,
+        engine="agents",
+        schedule_type="Random",
+        tiles=None,
+        processes=None,
+        columnar_output=None,
+        columnar_format="parquet",
+        early_stop=False,
+        steady_state_window=50,
+        steady_state_tolerance=0.01,
+        steady_state_max_period=20,
+        steady_state_hash=False,
+        seed=None,
+        profile=False,
+        profile_columns=False,
     ):
+        # constructor arguments, kept for checkpoints
+        self.parameters = {
+            name: value
+            for name, value in locals().items()
+            if name not in ("self", "__class__")
+        }
         super().__init__()
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = self.parameters["seed"] = seed
+        self.reset_randomizer(seed)
+        self.rng = np.random.default_rng(seed)
         self.width = width
         self.height = height
         self.citizen_density = citizen_density
@@ -68,16 +145,48 @@ class EpsteinCivilViolence(mesa.Model):
         self.max_iters = max_iters
         self.iteration = 0
         self.grid = mesa.space.HexGrid(width, height, torus=True)
-        self.schedule = mesa.time.RandomActivation(self)
+        self.neighborhoods = HexNeighborhoodIndex(self.grid)
+        self.neighborhoods.track(citizen_vision)
+        self.neighborhoods.track(cop_vision)
+        self.schedule_type = schedule_name(schedule_type)
+        self.schedule = make_schedule(self, self.schedule_type)
         self.international_aid = international_aid
         self.shock_amount = shock_amount
         self.aid_applied = False
+        if engine not in ("agents", "vectorized", "tiled"):
+            raise ValueError("Invalid engine, choose 'agents', 'vectorized' or 'tiled'")
+        if engine == "tiled" and self.schedule_type != "Simultaneous":
+            raise ValueError("The tiled engine needs schedule_type='Simultaneous'")
+        if engine != "agents" and self.schedule_type == "ActiveSet":
+            raise ValueError("schedule_type='ActiveSet' needs engine='agents'")
+        vision = max(citizen_vision, cop_vision)
+        if engine != "agents" and not self.neighborhoods.has_table(vision):
+            raise ValueError(
+                f"The {engine} engine needs a grid of even width and at least "
+                f"2 * vision + 1 = {2 * vision + 1} cells in each direction, "
+                f"not {width}x{height}; use engine='agents'"
+            )
+        self.engine = engine
+        self.tiles = tiles
+        self.processes = processes
+        self.vectorized = None
+        self.aggregates = None
+
+        self.profiler = PhaseProfiler() if profile or profile_columns else None
 
+        # all reporters read the tally taken once per collect()
+        self.counts = None
         model_reporters = {
-            "Quiescent": lambda m: self.count_type_citizens(m, "Quiescent"),
-            "Active": lambda m: self.count_type_citizens(m, "Active"),
-            "Jailed": self.count_jailed,
+            "Quiescent": lambda m: m.counts["Quiescent"],
+            "Active": lambda m: m.counts["Active"],
+            "Jailed": lambda m: m.counts["Jailed"],
         }
+        if profile_columns:
+            for phase in PHASES:
+                if phase != COLLECT:
+                    model_reporters[f"{phase}_seconds"] = (
+                        lambda m, phase=phase: m.profiler.seconds[phase]
+                    )
 
         agent_reporters = {
             "x": lambda a: a.pos[0],
@@ -90,67 +199,254 @@ class EpsteinCivilViolence(mesa.Model):
         self.datacollector = mesa.DataCollector(
             model_reporters=model_reporters) #, agent_reporters=agent_reporters)
             
-        unique_id = 0
         if self.cop_density + self.citizen_density > 1:
             raise ValueError("Cop density + citizen density must be less than 1")
-        for contents, (x, y) in self.grid.coord_iter():
-            legitimacy = self.generate_legitimacy() ### this is new
-            if self.random.random() < self.cop_density:
-                cop = Cop(unique_id, self, (x, y), vision=self.cop_vision)
-                unique_id += 1
-                self.grid[x][y] = cop
-                self.schedule.add(cop)
-            elif self.random.random() < (self.cop_density + self.citizen_density):
-                citizen = Citizen(
-                    unique_id,
-                    self,
-                    (x, y),
-                    hardship=self.random.random(),
-                    regime_legitimacy=legitimacy,
-                    risk_aversion=self.random.random(),
-                    threshold=self.active_threshold,
-                    vision=self.citizen_vision,
-                )
-                unique_id += 1
-                self.grid[x][y] = citizen
-                self.schedule.add(citizen)
+        self.populate()
 
+        self.build_engine()
+        self.columnar = None
+        if columnar_output is not None:
+            self.columnar = ColumnarCollector(self, columnar_output, columnar_format)
+        self.steady_state = None
+        if early_stop:
+            self.steady_state = SteadyStateDetector(
+                steady_state_window,
+                steady_state_tolerance,
+                steady_state_max_period,
+                steady_state_hash,
+            )
+        self.stop_reason = None
         self.running = True
-        self.datacollector.collect(self)
+        self.collect()
+
+    def build_engine(self):
+        """
+        Index the agents on the schedule and set up the engine state over
+        them: the vectorized or tiled engine's arrays or the neighborhood
+        aggregates.
+        """
+        for agent in self.schedule.agents:
+            self.neighborhoods.place(agent.pos)
+        if self.engine == "vectorized":
+            self.vectorized = VectorizedEngine(self)
+        elif self.engine == "tiled":
+            # exposes the VectorizedEngine interface the rest of the model uses
+            self.vectorized = TiledEngine(self, self.tiles, self.processes)
+        else:
+            self.aggregates = NeighborhoodAggregates(
+                self.neighborhoods, (self.citizen_vision, self.cop_vision)
+            )
+            self.aggregates.add_all(self.schedule.agents)
+            if self.schedule_type == "ActiveSet" and not self.movement:
+                self.aggregates.watch(self.citizen_vision)
 
     def step(self):
         """
         Advance the model by one step and collect data.
         """
         ###
-        
+        profiler = self.profiler
+        if profiler:
+            profiler.new_step()
         if not self.aid_applied and self.iteration == 100:
             self.adjust_legitimacy_based_on_aid()
             self.aid_applied = True
-            
-        for agent in self.schedule.agents:
-            if isinstance(agent, Citizen):
-                agent.update_neighbors() 
-                agent.update_grievance()
-        ###
-        self.schedule.step()
+            if self.steady_state is not None:
+                # the counts before the shock say nothing about where it settles
+                self.steady_state.reset()
+
+        if self.vectorized is not None:
+            start = time.perf_counter()
+            self.vectorized.step()
+            if profiler:
+                profiler.add(SCHEDULE, start)
+            self.schedule.steps += 1
+            self.schedule.time += 1
+        else:
+            self.step_agents()
         # collect data
-        self.datacollector.collect(self)
+        self.collect()
         self.iteration += 1
         if self.iteration > self.max_iters:
-            self.running = False
+            self.stop("max_iters")
+        elif (
+            self.steady_state is not None
+            and self.steady_state.update(self)
+            and (self.aid_applied or self.international_aid == "No Aid")
+        ):
+            self.stop(self.steady_state.reason)
+
+    def iter_steps(
+        self, max_steps=None, agent_state=False, events=False, keep_history=True
+    ):
+        """
+        Run the model as a generator of per-step StepRecords, for consumers
+        that plot, aggregate or stop early while the run is in progress:
+
+            for record in model.iter_steps(events=True, keep_history=False):
+                monitor(record.counts, record.arrests)
+
+        See streaming.stream() for the arguments.
+        """
+        # streaming builds on checkpoint, which imports this module
+        from .streaming import stream
+
+        return stream(self, max_steps, agent_state, events, keep_history)
+
+    def stop(self, reason):
+        """
+        End the run, recording why, and finalise the columnar output.
+        """
+        self.running = False
+        self.stop_reason = reason
+        self.close()
+
+    def close(self):
+        """
+        Finalise the columnar output files and stop the tiled engine's
+        workers, e.g. when a run is cut short before it stops by itself;
+        stop() does this too, and closing twice is harmless. Later steps
+        are no longer recorded in the columnar output, and the tiled engine
+        can no longer step. The model is also a context manager that closes
+        on exit:
+
+            with EpsteinCivilViolence(columnar_output="out") as model:
+                for _ in range(10):
+                    model.step()
+        """
+        if self.columnar is not None:
+            self.columnar.close()
+            self.columnar = None
+        if self.engine == "tiled":
+            self.vectorized.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def state_hash(self):
+        """
+        Hash of every agent's position, condition and jail term.
+        """
+        if self.vectorized is not None:
+            engine = self.vectorized
+            return hash(
+                (
+                    engine.position.tobytes(),
+                    engine.condition.tobytes(),
+                    engine.jail_sentence.tobytes(),
+                )
+            )
+        return hash(
+            tuple(
+                (
+                    agent.pos,
+                    getattr(agent, "condition_code", None),
+                    getattr(agent, "jail_sentence", None),
+                )
+                for agent in self.schedule.agents
+            )
+        )
+
+    def collect(self):
+        """
+        Record the current step in the DataCollector and, if enabled, in the
+        columnar collector.
+        """
+        start = time.perf_counter()
+        self.counts = self.tally()
+        self.datacollector.collect(self)
+        if self.columnar is not None:
+            self.columnar.collect()
+        if self.profiler:
+            self.profiler.add(COLLECT, start)
+
+    def step_agents(self):
+        """
+        Advance the Citizen/Cop objects through the mesa schedule in stages:
+        every citizen smooths its grievance from the neighborhood aggregates,
+        then the schedule steps the agents. Agents only list their neighbors
+        to move or arrest, and reuse that snapshot unless someone has moved in
+        or out of their vision since.
+        """
+        profiler = self.profiler
+        start = time.perf_counter()
+        # smoothing only changes the grievance of citizens about to decide
+        # it afresh or serving time, so the active-set schedule goes without
+        if self.schedule_type != "ActiveSet":
+            citizens = [a for a in self.schedule.agents if isinstance(a, Citizen)]
+            for agent in citizens:
+                agent.update_grievance()
+        if profiler:
+            profiler.add(GRIEVANCE, start)
+            start = time.perf_counter()
+        self.schedule.step()
+        if profiler:
+            profiler.add(SCHEDULE, start)
+
+    def move_agent(self, agent, pos):
+        """
+        Move `agent` to `pos` on the grid, invalidate the neighborhood
+        snapshots that can see either cell and shift the agent's share of the
+        neighborhood aggregates.
+        """
+        old_pos = agent.pos
+        self.grid.move_agent(agent, pos)
+        self.neighborhoods.record_move(old_pos, pos)
+        if self.aggregates is not None:
+            self.aggregates.move(agent, old_pos, pos)
+
+    def sync_agents(self):
+        """
+        Bring the Citizen/Cop objects and the grid up to date with the
+        vectorized engine's arrays. A no-op for the agent engine.
+        """
+        if self.vectorized is not None:
+            self.vectorized.sync_agents()
+
+    def tally(self):
+        """
+        Counts of free Quiescent and Active citizens, jailed citizens and
+        cops. Read from the running totals kept by the neighborhood
+        aggregates or the vectorized engine, or counted in a single pass.
+        """
+        if self.vectorized is not None:
+            return self.vectorized.tally()
+        if self.aggregates is not None:
+            return self.aggregates.tally()
+        return self.count_agents(self)
+
+    @staticmethod
+    def count_agents(model):
+        """
+        Helper method to count agents by Quiescent/Active/Jailed and cops in
+        a single pass over the schedule.
+        """
+        counts = {"Quiescent": 0, "Active": 0, "Jailed": 0, "Cops": 0}
+        for agent in model.schedule.agents:
+            if agent.breed == "cop":
+                counts["Cops"] += 1
+            elif agent.jail_sentence > 0:
+                counts["Jailed"] += 1
+            else:
+                counts[agent.condition] += 1
+        return counts
 
     @staticmethod
     def count_type_citizens(model, condition, exclude_jailed=True):
         """
         Helper method to count agents by Quiescent/Active.
         """
+        if exclude_jailed:
+            return model.tally()[condition]
+        if model.vectorized is not None:
+            return model.vectorized.count_type_citizens(condition, exclude_jailed)
         count = 0
         for agent in model.schedule.agents:
             if agent.breed == "cop":
                 continue
-            if exclude_jailed and agent.jail_sentence > 0:
-                continue
             if agent.condition == condition:
                 count += 1
         return count
@@ -160,35 +456,69 @@ class EpsteinCivilViolence(mesa.Model):
         """
         Helper method to count jailed agents.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "citizen" and agent.jail_sentence > 0:
-                count += 1
-        return count
+        return model.tally()["Jailed"]
 
     @staticmethod
     def count_cops(model):
         """
-        Helper method to count jailed agents.
+        Helper method to count cops.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                count += 1
-        return count
-    
-    def generate_legitimacy(self):
+        return model.tally()["Cops"]
+
+    def populate(self):
+        """
+        Draw the initial population for the whole lattice at once, then
+        create and place the agents in one pass in cell order. Each cell
+        holds a cop with probability cop_density, otherwise a citizen with
+        probability cop_density + citizen_density; citizens draw hardship,
+        risk aversion and legitimacy.
+        """
+        n_cells = self.width * self.height
+        cops = self.rng.random(n_cells) < self.cop_density
+        citizens = ~cops & (
+            self.rng.random(n_cells) < self.cop_density + self.citizen_density
+        )
+        n_citizens = int(citizens.sum())
+        hardship = iter(self.rng.random(n_citizens).tolist())
+        risk_aversion = iter(self.rng.random(n_citizens).tolist())
+        legitimacy = iter(self.generate_legitimacy(n_citizens).tolist())
+        is_cop = cops.tolist()
+        for unique_id, cell in enumerate(np.flatnonzero(cops | citizens).tolist()):
+            x, y = divmod(cell, self.height)
+            if is_cop[cell]:
+                agent = Cop(unique_id, self, (x, y), vision=self.cop_vision)
+            else:
+                agent = Citizen(
+                    unique_id,
+                    self,
+                    (x, y),
+                    hardship=next(hardship),
+                    regime_legitimacy=next(legitimacy),
+                    risk_aversion=next(risk_aversion),
+                    threshold=self.active_threshold,
+                    vision=self.citizen_vision,
+                )
+            self.grid[x][y] = agent
+            self.schedule.add(agent)
+
+    def generate_legitimacy(self, size=None):
         params = self.legitimacy_params[self.legitimacy_distribution]
         if self.legitimacy_distribution == 'uniform':
-            return np.random.uniform(*params)
+            return self.rng.uniform(*params, size=size)
         elif self.legitimacy_distribution == 'normal':
-            return np.clip(np.random.normal(*params), 0, 1)
+            return np.clip(self.rng.normal(*params, size=size), 0, 1)
         else:
             raise ValueError("Invalid distribution type")
 
     def adjust_legitimacy_based_on_aid(self):
         """ Adjust legitimacy based on the selected international aid and ensures the 
         shock is applied only once. """
+        if self.vectorized is not None:
+            if self.international_aid == "Aid Government":
+                self.vectorized.adjust_legitimacy(self.shock_amount)
+            elif self.international_aid == "Aid Rebellion":
+                self.vectorized.adjust_legitimacy(-self.shock_amount)
+            return
         if self.international_aid == "Aid Government":
             for agent in self.schedule.agents:
                 if isinstance(agent, Citizen):
@@ -199,3 +529,6 @@ class EpsteinCivilViolence(mesa.Model):
                 if isinstance(agent, Citizen):
                     agent.regime_legitimacy -= self.shock_amount  
                     agent.regime_legitimacy = max(agent.regime_legitimacy, 0)  
+        if self.aggregates.changed is not None:
+            # every citizen's decision may change
+            self.aggregates.changed[:] = True
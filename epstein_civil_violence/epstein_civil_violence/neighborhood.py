@@ -0,0 +1,300 @@
+import collections
+
+import numpy as np
+
+
+def hex_offsets(radius, parity):
+    """
+    Relative (dx, dy) offsets of the cells within `radius` of a cell whose x
+    coordinate has the given parity, following the odd-q layout used by
+    mesa's HexGrid. The center cell is excluded.
+    """
+    start = (parity, 0)
+    seen = {start}
+    frontier = collections.deque([start])
+    for _ in range(radius):
+        next_frontier = collections.deque()
+        for x, y in frontier:
+            if x % 2 == 0:
+                adjacent = [
+                    (x, y - 1), (x, y + 1), (x - 1, y + 1),
+                    (x - 1, y), (x + 1, y + 1), (x + 1, y),
+                ]
+            else:
+                adjacent = [
+                    (x, y - 1), (x, y + 1), (x - 1, y),
+                    (x - 1, y - 1), (x + 1, y), (x + 1, y - 1),
+                ]
+            for coord in adjacent:
+                if coord not in seen:
+                    seen.add(coord)
+                    next_frontier.append(coord)
+        frontier = next_frontier
+    seen.discard(start)
+    return sorted((x - parity, y) for x, y in seen)
+
+
+class HexNeighborhoodIndex:
+    """
+    Shared neighborhood lookups for a torus HexGrid.
+
+    Relative offsets are computed once per (vision, column parity) pair;
+    mesa's HexGrid uses odd-q layout, so the parity of the x coordinate is
+    what distinguishes the two offset patterns. From those offsets the index
+    builds, per vision, one (width * height, K) table of flat cell indices
+    (x * height + y) with every row sorted, and hands out rows of it as the
+    neighborhood of a cell: all agents share the same read-only views and no
+    per-cell Python objects are kept.
+
+    Neighborhoods match grid.get_neighborhood(pos, include_center=False,
+    radius=vision), including its sorted order. Wrapping offsets only
+    preserves the hex adjacency when the grid is a torus of even width, and a
+    fixed-width table needs every neighborhood to have K distinct cells, i.e.
+    a grid of at least 2 * vision + 1 cells in each direction; otherwise the
+    index falls back to per-cell arrays cached on first use.
+
+    The index also keeps a flat occupancy mask and tracks occupancy changes
+    for the visions registered with track(): every move bumps a clock and
+    stamps the cells whose neighborhood contains the vacated or the entered
+    cell. A neighborhood snapshot taken at clock value t is still exact while
+    the stamp of its center cell is <= t.
+    """
+
+    def __init__(self, grid):
+        """
+        Create a new index.
+        Args:
+            grid: the model's HexGrid
+        """
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.use_offsets = grid.torus and grid.width % 2 == 0
+        self.dtype = np.int32 if self.width * self.height < 2**31 else np.int64
+        self.occupied = np.zeros(self.width * self.height, dtype=bool)
+        self._offsets = {}
+        self._offset_lists = {}
+        self._has_table = {}
+        self._rows = {}
+        self._indices = {}
+        self._stamps = {}
+        self.clock = 0
+
+    def offsets(self, vision, parity):
+        """
+        (K, 2) array of (dx, dy) offsets for cells of the given x parity.
+        """
+        key = (vision, parity)
+        offsets = self._offsets.get(key)
+        if offsets is None:
+            offsets = np.array(hex_offsets(vision, parity), dtype=np.int64)
+            offsets = offsets.reshape(-1, 2)
+            self._offsets[key] = offsets
+        return offsets
+
+    def has_table(self, vision):
+        has_table = self._has_table.get(vision)
+        if has_table is None:
+            has_table = self._has_table[vision] = (
+                self.use_offsets and min(self.width, self.height) >= 2 * vision + 1
+            )
+        return has_table
+
+    def size(self, pos, vision):
+        """
+        Number of cells within `vision` of `pos`.
+        """
+        if self.has_table(vision):
+            return len(self.offsets(vision, 0))
+        return len(self.cell_indices(pos, vision))
+
+    def rows(self, vision):
+        """
+        Sorted flat neighbor indices of every cell as an array of shape
+        (width * height, K).
+        """
+        rows = self._rows.get(vision)
+        if rows is None:
+            if not self.has_table(vision):
+                raise ValueError(
+                    "Neighborhood tables need a torus of even width and at "
+                    "least 2 * vision + 1 cells in each direction"
+                )
+            rows = np.empty(
+                (self.width, self.height, len(self.offsets(vision, 0))),
+                dtype=self.dtype,
+            )
+            for parity in (0, 1):
+                offsets = self.offsets(vision, parity).astype(self.dtype)
+                # a neighbor's index is a column term plus a row term
+                xs = np.arange(parity, self.width, 2, dtype=self.dtype)
+                nx = (xs[:, None] + offsets[:, 0]) % self.width * self.height
+                ys = np.arange(self.height, dtype=self.dtype)
+                ny = (ys[:, None] + offsets[:, 1]) % self.height
+                np.add(nx[:, None, :], ny[None, :, :], out=rows[parity::2])
+            rows = rows.reshape(self.width * self.height, -1)
+            rows.sort(axis=1)
+            rows.flags.writeable = False
+            self._rows[vision] = rows
+        return rows
+
+    def table(self, vision):
+        """
+        The rows() table transposed to shape (K, width * height), so that
+        table[k] is the k-th neighbor of each cell.
+        """
+        return self.rows(vision).T
+
+    def sums(self, field, vision):
+        """
+        Sum of a per-cell `field` (shape (width * height, ...)) over the
+        cells within `vision` of every cell, as the table would give it but
+        without gathering K rows: the hex neighborhood of a cell is one run
+        of cells per column, so prefix sums down the columns give each run
+        in one subtraction. Needs has_table(vision).
+        """
+        width, height = self.width, self.height
+        values = field.reshape(width, height, -1)
+        # wrapped by `vision` cells on every side, then summed down columns
+        padded = np.pad(values, ((vision, vision), (vision, vision), (0, 0)), "wrap")
+        prefix = np.zeros((padded.shape[0], padded.shape[1] + 1, padded.shape[2]))
+        np.cumsum(padded, axis=1, out=prefix[:, 1:])
+        sums = -values  # the center's run includes the center
+        for parity in (0, 1):
+            offsets = self.offsets(vision, parity)
+            out = sums[parity::2]
+            for dx in np.unique(offsets[:, 0]).tolist():
+                dys = offsets[offsets[:, 0] == dx, 1]
+                start = vision + parity + dx
+                columns = prefix[start : start + width - parity : 2]
+                low = vision + int(dys.min())
+                high = vision + int(dys.max()) + 1
+                out += columns[:, high : high + height] - columns[:, low : low + height]
+        return sums.reshape(field.shape)
+
+    def cell_indices(self, pos, vision):
+        """
+        Sorted flat indices of the cells within `vision` of `pos`.
+        """
+        x, y = pos
+        if self.has_table(vision):
+            return self.rows(vision)[x * self.height + y]
+        key = (pos, vision)
+        indices = self._indices.get(key)
+        if indices is None:
+            if self.use_offsets:
+                offsets = self.offsets(vision, x % 2)
+                indices = np.unique(
+                    (x + offsets[:, 0]) % self.width * self.height
+                    + (y + offsets[:, 1]) % self.height
+                )
+                # a vision wider than the grid wraps back onto the center
+                indices = indices[indices != x * self.height + y]
+            else:
+                indices = np.array(
+                    [
+                        cx * self.height + cy
+                        for cx, cy in self.grid.get_neighborhood(
+                            pos, include_center=False, radius=vision
+                        )
+                    ],
+                    dtype=np.int64,
+                )
+            indices = indices.astype(self.dtype)
+            indices.flags.writeable = False
+            self._indices[key] = indices
+        return indices
+
+    def coordinates(self, index):
+        """
+        (x, y) coordinate tuple of a flat cell index.
+        """
+        return divmod(int(index), self.height)
+
+    def neighborhood(self, pos, vision):
+        """
+        Tuple of (x, y) coordinates of the cells within `vision` of `pos`.
+        """
+        xs, ys = np.divmod(self.cell_indices(pos, vision), self.height)
+        return tuple(zip(xs.tolist(), ys.tolist()))
+
+    def empty_cells(self, pos, vision):
+        """
+        Sorted flat indices of the empty cells within `vision` of `pos`.
+        """
+        indices = self.cell_indices(pos, vision)
+        return indices[~self.occupied[indices]]
+
+    def random_empty_cell(self, pos, vision, random, tries=32):
+        """
+        A uniformly random empty cell (flat index) within `vision` of `pos`,
+        or None if there is none.
+
+        Draws cells of the neighborhood until an empty one comes up, which
+        takes K / (number of empty cells) draws on average and never lists
+        the neighborhood; only after `tries` misses in a row are the empty
+        cells listed to pick from (or to find there are none).
+        Args:
+            random: a random.Random, such as the agent's
+        """
+        occupied = self.occupied
+        if self.has_table(vision):
+            x, y = pos
+            key = (vision, x % 2)
+            offsets = self._offset_lists.get(key)
+            if offsets is None:
+                offsets = self._offset_lists[key] = self.offsets(*key).tolist()
+            size = len(offsets)
+            for _ in range(tries):
+                dx, dy = offsets[int(random.random() * size)]
+                cell = (x + dx) % self.width * self.height + (y + dy) % self.height
+                if not occupied[cell]:
+                    return cell
+        indices = self.cell_indices(pos, vision)
+        empty = indices[~occupied[indices]]
+        if len(empty):
+            return random.choice(empty)
+        return None
+
+    def neighbors(self, pos, vision):
+        """
+        Agents within `vision` of `pos`, in the order of their cells.
+        """
+        indices = self.cell_indices(pos, vision)
+        xs, ys = np.divmod(indices[self.occupied[indices]], self.height)
+        grid = self.grid._grid
+        return [grid[x][y] for x, y in zip(xs.tolist(), ys.tolist())]
+
+    def place(self, pos):
+        """
+        Mark `pos` as occupied (agents placed outside of moves).
+        """
+        x, y = pos
+        self.occupied[x * self.height + y] = True
+
+    def track(self, vision):
+        """
+        Start recording occupancy changes for neighborhoods of `vision`.
+        """
+        if vision not in self._stamps:
+            self._stamps[vision] = np.zeros(self.width * self.height, dtype=np.int64)
+
+    def record_move(self, old_pos, new_pos):
+        """
+        Note that an agent moved from `old_pos` to `new_pos`.
+        """
+        self.clock += 1
+        self.occupied[old_pos[0] * self.height + old_pos[1]] = False
+        self.occupied[new_pos[0] * self.height + new_pos[1]] = True
+        for vision, stamps in self._stamps.items():
+            for x, y in (old_pos, new_pos):
+                stamps[self.cell_indices((x, y), vision)] = self.clock
+                stamps[x * self.height + y] = self.clock
+
+    def unchanged_since(self, pos, vision, clock):
+        """
+        Whether no cell within `vision` of `pos` (nor `pos` itself) changed
+        occupancy after the clock read `clock`.
+        """
+        x, y = pos
+        return self._stamps[vision][x * self.height + y] <= clock
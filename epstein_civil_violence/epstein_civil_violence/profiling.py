@@ -0,0 +1,106 @@
+import collections
+import time
+
+# Phases of a step. grievance, schedule and collect cover the model-level
+# stages; the others are timed inside the agents (or the vectorized
+# engine, which runs its grievance pass inside schedule too) and add up to
+# most of schedule.
+GRIEVANCE = "grievance"
+SCHEDULE = "schedule"
+NEIGHBORS = "neighbors"
+ARREST_PROBABILITY = "arrest_probability"
+ACTIVATION = "activation"
+ARRESTS = "arrests"
+MOVEMENT = "movement"
+COLLECT = "collect"
+PHASES = (
+    GRIEVANCE,
+    SCHEDULE,
+    NEIGHBORS,
+    ARREST_PROBABILITY,
+    ACTIVATION,
+    ARRESTS,
+    MOVEMENT,
+    COLLECT,
+)
+
+
+class PhaseProfiler:
+    """
+    Accumulates wall time and call counts per phase of the step loop.
+
+    The model holds one in `profiler` when created with profile=True and
+    None otherwise; instrumented code only tests that attribute, so an
+    unprofiled run pays a single attribute check per hook.
+
+    Code inside an agent's step marks phase boundaries with start() and
+    lap(phase), which charge the time since the previous mark to `phase`;
+    enclosing stages use add(phase, since) with their own start time, so
+    the two can nest.
+
+    Attributes:
+        seconds, calls: per-phase totals of the current step
+        history: (seconds, calls) of the last `history_length` finished
+            steps; older steps only count in totals()
+    """
+
+    def __init__(self, history_length=100):
+        """
+        Args:
+            history_length: number of finished steps kept in `history`
+        """
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.history = collections.deque(maxlen=history_length)
+        # totals of the finished steps, however many `history` still holds
+        self.finished_seconds = dict.fromkeys(PHASES, 0.0)
+        self.finished_calls = dict.fromkeys(PHASES, 0)
+        self.mark = 0.0
+
+    def new_step(self):
+        """
+        File the current step's totals in `history` and the running totals
+        and start a new step.
+        """
+        for phase in PHASES:
+            self.finished_seconds[phase] += self.seconds[phase]
+            self.finished_calls[phase] += self.calls[phase]
+        self.history.append((self.seconds, self.calls))
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+
+    def start(self):
+        self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.seconds[phase] += now - self.mark
+        self.calls[phase] += 1
+        self.mark = now
+
+    def add(self, phase, since):
+        self.seconds[phase] += time.perf_counter() - since
+        self.calls[phase] += 1
+
+    def totals(self):
+        """
+        Seconds and calls per phase over the whole run so far.
+        """
+        seconds = {
+            phase: self.finished_seconds[phase] + self.seconds[phase]
+            for phase in PHASES
+        }
+        calls = {
+            phase: self.finished_calls[phase] + self.calls[phase] for phase in PHASES
+        }
+        return seconds, calls
+
+    def report(self):
+        """
+        Text table of the run's totals per phase.
+        """
+        seconds, calls = self.totals()
+        lines = [f"{'phase':20} {'seconds':>10} {'calls':>10}"]
+        for phase in PHASES:
+            lines.append(f"{phase:20} {seconds[phase]:10.4f} {calls[phase]:10d}")
+        return "\n".join(lines)
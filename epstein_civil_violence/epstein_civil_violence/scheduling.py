@@ -0,0 +1,234 @@
+import mesa
+import numpy as np
+
+SCHEDULE_TYPES = ("Random", "Simultaneous", "Staged", "Base", "ActiveSet")
+
+# the mesa class names offered by the server's "Updating Scheme" choice
+ALIASES = {
+    "RandomActivation": "Random",
+    "SimultaneousActivation": "Simultaneous",
+    "StagedActivation": "Staged",
+    "BaseScheduler": "Base",
+    "ActiveSetActivation": "ActiveSet",
+}
+
+
+class GeneratorShuffleMixin:
+    """
+    Shuffle the activation order with the model's NumPy Generator
+    (model.rng) instead of model.random, so that a model seed fixes the
+    order as well. Agents without the method being run sit it out.
+    """
+
+    def shuffled(self, agent_keys):
+        return [agent_keys[i] for i in self.model.rng.permutation(len(agent_keys))]
+
+    def get_agent_keys(self, shuffle=False):
+        agent_keys = list(self._agents.keys())
+        return self.shuffled(agent_keys) if shuffle else agent_keys
+
+    def do_each(self, method, agent_keys=None, shuffle=False):
+        if agent_keys is None:
+            agent_keys = self.get_agent_keys()
+        if shuffle:
+            agent_keys = self.shuffled(agent_keys)
+        for agent_key in agent_keys:
+            agent = self._agents.get(agent_key)
+            if agent is not None:
+                action = getattr(agent, method, None)
+                if action is not None:
+                    action()
+
+
+class RandomActivation(GeneratorShuffleMixin, mesa.time.RandomActivation):
+    """
+    mesa's RandomActivation, shuffled by model.rng.
+    """
+
+
+class BaseScheduler(GeneratorShuffleMixin, mesa.time.BaseScheduler):
+    """
+    mesa's BaseScheduler: agents step one at a time in the order added.
+    """
+
+
+class StagedActivation(GeneratorShuffleMixin, mesa.time.StagedActivation):
+    """
+    mesa's StagedActivation, shuffled by model.rng.
+    """
+
+
+class SimultaneousActivation(GeneratorShuffleMixin, mesa.time.BaseScheduler):
+    """
+    Two-phase synchronous updating.
+
+    In the compute phase every agent's plan() works out its update from the
+    state at the start of the step and stores it on the agent without
+    touching anything other agents read, so the phase sees one frozen
+    snapshot and could be batched or run in parallel. The commit phase then
+    applies the plans stage by stage over all agents in random order:
+    citizens' own state, arrests, then moves. Conflicts are settled at
+    commit: a citizen already arrested is not arrested again, and a cell
+    already taken is not entered.
+    """
+
+    stage_list = ("commit_state", "commit_arrest", "commit_move")
+
+    def step(self):
+        self.do_each("plan")
+        agent_keys = self.get_agent_keys(shuffle=True)
+        for stage in self.stage_list:
+            self.do_each(stage, agent_keys)
+        self.steps += 1
+        self.time += 1
+
+
+class ActiveSetActivation(GeneratorShuffleMixin, mesa.time.BaseScheduler):
+    """
+    Random activation over only the agents that can change state.
+
+    Jailed citizens are not stepped to count down their sentence: they are
+    parked in a timer wheel keyed by the step they are released at (their
+    jail_sentence is worked out from it) and rejoin the free citizens when
+    that step comes round; sentences run out between steps. A free citizen
+    decides from the cops, Active, jailed and occupied counts in its vision
+    alone, so when it has not moved and those counts have not changed since
+    its last decision it would decide the same again. Without movement such
+    citizens are skipped, as if they had acted first in the step; the
+    model's aggregates flag the cells whose counts change (see
+    NeighborhoodAggregates.watch). With movement every free citizen moves,
+    so acts, every step.
+
+    The cops and the free citizens left to act go in one random order. The
+    model also skips its grievance smoothing pre-pass under this schedule:
+    a free citizen's smoothed grievance is replaced by its decision the same
+    step and a jailed one's feeds into nothing. A step thus costs in
+    proportion to the agents that can change state rather than to the
+    population.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.cops = {}
+        # free citizens by key; jailed ones are only in the wheel
+        self.free = {}
+        # release step -> citizens released at the end of the step before
+        self.wheel = {}
+        # jailed citizens added since the last step, parked when it starts
+        self.arrivals = []
+        # free citizens to act next step whatever their counts: those just
+        # released, and those let off with no sentence (made Quiescent)
+        self.woken = []
+
+    def add(self, agent):
+        super().add(agent)
+        if agent.breed == "cop":
+            self.cops[agent.unique_id] = agent
+        elif agent.jail_sentence:
+            self.arrivals.append(agent)
+        else:
+            self.free[agent.unique_id] = agent
+
+    def remove(self, agent):
+        super().remove(agent)
+        self.cops.pop(agent.unique_id, None)
+        self.free.pop(agent.unique_id, None)
+
+    def park(self, citizen, release):
+        """
+        Hold a jailed citizen until the end of step `release` - 1.
+        """
+        citizen.release = release
+        self.wheel.setdefault(release, []).append(citizen)
+        self.free.pop(citizen.unique_id, None)
+
+    def unsettled(self):
+        """
+        The free citizens whose counts may have changed since they last
+        decided, those standing on flagged cells, and the woken ones.
+        """
+        model = self.model
+        changed = model.aggregates.changed
+        cells = np.flatnonzero(changed)
+        changed[:] = False
+        citizens = {}
+        xs, ys = np.divmod(cells, model.height)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            agent = model.grid[x][y]
+            if agent is not None and agent.unique_id in self.free:
+                citizens[agent.unique_id] = agent
+        for citizen in self.woken:
+            if citizen.unique_id in self.free:
+                citizens[citizen.unique_id] = citizen
+        return [citizens[key] for key in sorted(citizens)]
+
+    def step(self):
+        model = self.model
+        for citizen in self.arrivals:
+            self.park(citizen, self.steps + citizen.jail_sentence)
+        self.arrivals = []
+        if model.movement:
+            # in key order, which does not depend on who was jailed when
+            citizens = [self.free[key] for key in sorted(self.free)]
+        else:
+            citizens = self.unsettled()
+        self.woken = []
+        agents = list(self.cops.values()) + citizens
+        for i in model.rng.permutation(len(agents)).tolist():
+            agent = agents[i]
+            if agent.breed == "cop":
+                arrestee = agent.arrest()
+                if arrestee is not None:
+                    if arrestee.jail_sentence:
+                        # serves from the end of this step
+                        self.park(arrestee, self.steps + arrestee.jail_sentence + 1)
+                    else:
+                        self.woken.append(arrestee)
+                if model.movement:
+                    agent.move()
+            elif not agent.jail_sentence:
+                agent.step()
+        self.steps += 1
+        self.time += 1
+        for citizen in self.wheel.pop(self.steps, ()):
+            if citizen.unique_id in self._agents:
+                citizen.jail_sentence = 0
+                self.free[citizen.unique_id] = citizen
+                self.woken.append(citizen)
+
+
+def schedule_name(schedule_type):
+    """
+    The canonical name ("Random", "Simultaneous", "Staged", "Base" or
+    "ActiveSet") of a schedule type, which may also be given as its mesa class name.
+    """
+    name = ALIASES.get(schedule_type, schedule_type)
+    if name not in SCHEDULE_TYPES:
+        raise ValueError(
+            "Invalid schedule type, choose 'Random', 'Simultaneous', 'Staged', "
+            "'Base' or 'ActiveSet'"
+        )
+    return name
+
+
+def make_schedule(model, schedule_type):
+    """
+    Create an empty scheduler of the given type for `model`.
+
+    Staged activation runs every citizen's update_state, then every cop's
+    arrest, then (with movement) everyone's move, in one random order per
+    step.
+    """
+    name = schedule_name(schedule_type)
+    if name == "Random":
+        return RandomActivation(model)
+    if name == "Simultaneous":
+        return SimultaneousActivation(model)
+    if name == "Staged":
+        stage_list = ["update_state", "arrest"]
+        if model.movement:
+            stage_list.append("move")
+        return StagedActivation(model, stage_list, shuffle=True)
+    if name == "ActiveSet":
+        return ActiveSetActivation(model)
+    return BaseScheduler(model)
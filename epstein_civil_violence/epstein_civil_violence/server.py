@@ -49,7 +49,13 @@ def citizen_cop_portrayal(agent):
 
 updating_scheme_param = Choice(
     "Updating Scheme",
-    choices=["RandomActivation", "SimultaneousActivation", "StagedActivation", "BaseScheduler"],
+    choices=[
+        "RandomActivation",
+        "SimultaneousActivation",
+        "StagedActivation",
+        "BaseScheduler",
+        "ActiveSetActivation",
+    ],
     value="RandomActivation"
 )
 
@@ -86,7 +92,8 @@ model_params = {
     "legitimacy_param_normal_stddev": legitimacy_param_normal_stddev,
     "max_jail_term": mesa.visualization.Slider("Max Jail Term", 30, 0, 50, 1),
     "international_aid": international_aid_param,
-    "shock_amount": shock_amount
+    "shock_amount": shock_amount,
+    "schedule_type": updating_scheme_param,
 }
 
 
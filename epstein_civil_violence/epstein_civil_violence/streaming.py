@@ -0,0 +1,133 @@
+import numpy as np
+
+from .checkpoint import agent_state
+from .vectorized import ACTIVE, COP
+
+# per-agent arrays of a StepRecord, as laid out by checkpoint.agent_state
+AGENT_FIELDS = (
+    "breed",
+    "position",
+    "hardship",
+    "regime_legitimacy",
+    "risk_aversion",
+    "grievance",
+    "condition",
+    "jail_sentence",
+    "arrest_probability",
+)
+
+
+class StepRecord:
+    """
+    What one step of a run produced.
+
+    Attributes:
+        step: number of steps the model has taken
+        counts: {"Quiescent", "Active", "Jailed", "Cops"} after the step
+        agents: with agent_state=True, a dict of per-agent arrays
+            ("unique_id" and AGENT_FIELDS) in a fixed agent order, else None.
+            With the vectorized engine these are the engine's own arrays, so
+            they are only valid until the next step; copy what must be kept.
+        arrests: with events=True, unique ids of the citizens jailed in the
+            step, else None
+        activations: unique ids of the free citizens that turned Active
+        deactivations: unique ids of the free citizens that turned Quiescent
+        releases: unique ids of the citizens whose sentence ran out
+    """
+
+    __slots__ = (
+        "step",
+        "counts",
+        "agents",
+        "arrests",
+        "activations",
+        "deactivations",
+        "releases",
+    )
+
+    def __init__(self, step, counts, agents=None):
+        self.step = step
+        self.counts = counts
+        self.agents = agents
+        self.arrests = self.activations = self.deactivations = self.releases = None
+
+    def __repr__(self):
+        return f"StepRecord(step={self.step}, counts={self.counts})"
+
+
+def agent_views(model, unique_id=None):
+    """
+    The model's per-agent arrays: the engine's arrays themselves when it
+    keeps some, else built from the Citizen/Cop objects.
+    Args:
+        unique_id: the engine's agents' ids, to save rebuilding them
+    """
+    engine = model.vectorized
+    if engine is None:
+        return agent_state(model)
+    if unique_id is None:
+        unique_id = np.array([agent.unique_id for agent in engine.agents])
+    views = {"unique_id": unique_id}
+    for name in AGENT_FIELDS:
+        views[name] = getattr(engine, name)
+    return views
+
+
+def stream(model, max_steps=None, agent_state=False, events=False, keep_history=True):
+    """
+    Step `model` and yield a StepRecord after every step, until the model
+    stops or after `max_steps` steps. Stop early by leaving the loop.
+
+    When the loop ends, however it ends, the model is closed (see
+    EpsteinCivilViolence.close()), so its columnar output files are complete.
+
+    Events are found by comparing every agent's condition and jail term with
+    the step before, which costs a pass over the agents per step; an
+    arrest with a sentence of 0 leaves no trace and is not reported.
+    Args:
+        model: EpsteinCivilViolence instance
+        max_steps: optional limit on the number of steps
+        agent_state: attach the per-agent arrays to each record
+        events: attach arrests, activations, deactivations and releases
+        keep_history: keep the model's DataCollector series; with False
+            each step's row is dropped once collected, so memory stays
+            constant however long the run (the steady-state detector and
+            the columnar collector are unaffected)
+    """
+    unique_id = None
+    if model.vectorized is not None:
+        unique_id = np.array([agent.unique_id for agent in model.vectorized.agents])
+    previous = None
+    if events:
+        views = agent_views(model, unique_id)
+        previous = (views["condition"].copy(), views["jail_sentence"].copy())
+    taken = 0
+    with model:
+        while model.running and (max_steps is None or taken < max_steps):
+            model.step()
+            taken += 1
+            if not keep_history:
+                for values in model.datacollector.model_vars.values():
+                    values.clear()
+            record = StepRecord(model.schedule.steps, dict(model.counts))
+            if agent_state or events:
+                views = agent_views(model, unique_id)
+                if agent_state:
+                    record.agents = views
+                if events:
+                    condition, jail = views["condition"], views["jail_sentence"]
+                    was_condition, was_jailed = previous[0], previous[1] > 0
+                    jailed = jail > 0
+                    citizens = views["breed"] != COP
+                    free = citizens & ~jailed & ~was_jailed
+                    ids = views["unique_id"]
+                    record.arrests = ids[citizens & jailed & ~was_jailed]
+                    record.releases = ids[citizens & was_jailed & ~jailed]
+                    record.activations = ids[
+                        free & (condition == ACTIVE) & (was_condition != ACTIVE)
+                    ]
+                    record.deactivations = ids[
+                        free & (condition != ACTIVE) & (was_condition == ACTIVE)
+                    ]
+                    previous = (condition.copy(), jail.copy())
+            yield record
@@ -0,0 +1,333 @@
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from .cache import (
+    OUTPUT_PARAMETERS,
+    ResultCache,
+    model_parameters,
+    run_key,
+    writes_outputs,
+)
+from .ensemble import Ensemble
+from .model import EpsteinCivilViolence
+
+
+def make_jobs(parameters, iterations, seed=None):
+    """
+    Expand a parameter dict into (run_id, iteration, kwargs) jobs.
+    Args:
+        parameters: dict of model parameter name to a single value or an
+            iterable of values to sweep; strings count as single values
+        iterations: number of replicates per parameter combination
+        seed: root seed; every job gets its own independent stream spawned
+            from it as its "seed" kwarg, unless `parameters` sets "seed".
+            The stream depends only on the job's parameter combination
+            (OUTPUT_PARAMETERS aside) and iteration, so growing the grid, or
+            profiling it, leaves existing runs unchanged.
+    """
+    names = list(parameters)
+    values = []
+    for name in names:
+        value = parameters[name]
+        if isinstance(value, str) or not hasattr(value, "__iter__"):
+            value = [value]
+        values.append(list(value))
+    combinations = [dict(zip(names, combo)) for combo in itertools.product(*values)]
+    jobs = []
+    for iteration in range(iterations):
+        for kwargs in combinations:
+            jobs.append((len(jobs), iteration, dict(kwargs)))
+    if "seed" not in parameters:
+        entropy = np.random.SeedSequence(seed).entropy
+        for _, iteration, kwargs in jobs:
+            kwargs["seed"] = job_seed(entropy, kwargs, iteration)
+    return jobs
+
+
+def job_seed(entropy, kwargs, iteration):
+    """
+    The seed of replicate `iteration` of the run with parameters `kwargs`,
+    drawn from an independent stream under the root `entropy`.
+    """
+    kwargs = {k: v for k, v in kwargs.items() if k not in OUTPUT_PARAMETERS}
+    description = json.dumps(kwargs, sort_keys=True, default=str).encode()
+    digest = np.frombuffer(hashlib.sha256(description).digest(), np.uint32)
+    child = np.random.SeedSequence(entropy, spawn_key=(iteration, *digest.tolist()))
+    return int(child.generate_state(1, np.uint64)[0])
+
+
+def run_job(job, max_steps, data_collection_period):
+    """
+    Run one model to completion and return its rows, one per collected step,
+    in the same layout as mesa.batch_run. A columnar_output directory gets a
+    subdirectory per run, named by run_directory().
+    """
+    run_id, iteration, kwargs = job
+    if kwargs.get("columnar_output") is not None:
+        directory = run_directory(run_id, kwargs.get("seed"))
+        kwargs = dict(
+            kwargs, columnar_output=os.path.join(kwargs["columnar_output"], directory)
+        )
+    with EpsteinCivilViolence(**kwargs) as model:
+        while model.running and model.schedule.steps <= max_steps:
+            model.step()
+    model_vars = model.datacollector.model_vars
+    rows = []
+    for step in collected_steps(model.schedule.steps, data_collection_period):
+        row = {"RunId": run_id, "iteration": iteration, "Step": step}
+        row.update(kwargs)
+        row.update({name: values[step] for name, values in model_vars.items()})
+        row["stop_reason"] = model.stop_reason or "max_steps"
+        rows.append(row)
+    return rows
+
+
+def run_directory(run_id, seed):
+    """
+    Name of the columnar output directory of a sweep run: the RunId and, for
+    a seeded run, the seed, so sweeps appending to one output keep apart.
+    """
+    if seed is None:
+        return f"run_{run_id}"
+    return f"run_{run_id}_seed_{seed}"
+
+
+def collected_steps(n_steps, data_collection_period):
+    """
+    The steps of a run of `n_steps` steps that get a row: every n-th and the
+    last, or only the last for a period of -1.
+    """
+    last = n_steps - 1
+    if data_collection_period > 0:
+        steps = list(range(0, n_steps, data_collection_period))
+        if not steps or steps[-1] != last:
+            steps.append(last)
+        return steps
+    return [last]
+
+
+def run_ensemble_job(jobs, max_steps, data_collection_period):
+    """
+    Run the replicates of one parameter combination in lockstep as an
+    Ensemble and return the rows of all of them, in the layout of run_job.
+    Args:
+        jobs: the combination's jobs, which differ only in their seed
+    """
+    kwargs = dict(jobs[0][2])
+    kwargs.pop("seed", None)
+    ensemble = Ensemble(seeds=[job[2]["seed"] for job in jobs], **kwargs)
+    # as many steps as run_job takes
+    series = ensemble.run(max_steps + 1)
+    stop_reason = "max_steps" if ensemble.running else "max_iters"
+    rows = []
+    for r, (run_id, iteration, kwargs) in enumerate(jobs):
+        for step in collected_steps(ensemble.iteration, data_collection_period):
+            row = {"RunId": run_id, "iteration": iteration, "Step": step}
+            row.update(kwargs)
+            row.update({name: int(values[step, r]) for name, values in series.items()})
+            row["stop_reason"] = stop_reason
+            rows.append(row)
+    return rows
+
+
+def relabel(rows, unit):
+    """
+    Cached `rows` of the jobs in `unit` (as many rows for each, job by job)
+    with the RunId, iteration and parameter columns of those jobs: runs that
+    differ only in parameters outside the cache key, or in spelling out
+    defaults, share their results but not their columns.
+    """
+    names = {"RunId", "iteration", "Step", *model_parameters({})}
+    per_job = len(rows) // len(unit)
+    relabeled = []
+    for i, row in enumerate(rows):
+        run_id, iteration, kwargs = unit[i // per_job]
+        new = {"RunId": run_id, "iteration": iteration, "Step": row["Step"]}
+        new.update(kwargs)
+        new.update({name: value for name, value in row.items() if name not in names})
+        relabeled.append(new)
+    return relabeled
+
+
+def group_jobs(jobs):
+    """
+    Group jobs by parameter combination, ignoring the seed.
+    """
+    groups = {}
+    for job in jobs:
+        kwargs = {name: value for name, value in job[2].items() if name != "seed"}
+        key = json.dumps(kwargs, sort_keys=True, default=str)
+        groups.setdefault(key, []).append(job)
+    return list(groups.values())
+
+
+def _run_job(args):
+    return run_job(*args)
+
+
+def _run_ensemble_job(args):
+    return run_ensemble_job(*args)
+
+
+def run_sweep(
+    parameters,
+    output,
+    iterations=1,
+    max_steps=1000,
+    data_collection_period=-1,
+    processes=None,
+    seed=None,
+    cache=None,
+    ensemble=False,
+):
+    """
+    Sweep EpsteinCivilViolence over a parameter grid on a process pool,
+    appending each run's rows to a CSV file as soon as the run finishes.
+
+    Rows are written in completion order and flushed run by run, so a crash
+    loses only the runs in flight and memory does not grow with the sweep.
+    The header is written only when `output` is new or empty, so repeated
+    calls append to the same file, in its columns; runs with other columns
+    (another parameter set) raise a ValueError. A run whose RunId and seed
+    already have rows there is not written again, so rerunning a seeded
+    sweep leaves the file as it was.
+
+    With a cache, runs whose results are already stored (same parameters,
+    seed, max_steps, collection period and model code) are read back instead
+    of simulated, and newly finished runs are stored, so refining a seeded
+    sweep only computes the missing runs. Runs that write columnar output or
+    profile their steps always run; each writes its columnar files to its
+    own subdirectory of columnar_output (see run_job).
+
+    With `ensemble`, the `iterations` replicates of each parameter
+    combination run in one process as an Ensemble, stepped together on the
+    vectorized engine, and are written and cached a combination at a time.
+    Their rows say engine="vectorized" and are the rows the same sweep
+    gives without `ensemble` on that engine: each seed reproduces its run
+    on its own. The grids swept must suit that engine (an even width and at
+    least 2 * vision + 1 cells in each direction).
+
+    Args:
+        parameters: dict of model parameters, as for mesa.batch_run
+        output: path of the CSV file to append to
+        iterations: number of replicates per parameter combination
+        max_steps: maximum number of steps per run
+        data_collection_period: collect every n-th step; -1 collects only
+            the final step
+        processes: worker count, defaults to the number of CPUs
+        seed: root seed of the sweep; the same seed reproduces every run,
+            whatever the process count or completion order
+        cache: optional ResultCache, or a directory to open one in
+        ensemble: run each combination's replicates in lockstep
+    Returns:
+        the number of runs completed
+    """
+    if ensemble:
+        # a replicate is exactly the vectorized run of its seed
+        parameters = dict(parameters, engine=parameters.get("engine", "vectorized"))
+    jobs = make_jobs(parameters, iterations, seed)
+    completed = 0
+    for rows in run_jobs(
+        jobs, output, max_steps, data_collection_period, processes, cache, ensemble
+    ):
+        completed += len({row["RunId"] for row in rows})
+    return completed
+
+
+def run_identity(row):
+    """
+    (RunId, seed) of a row as text, as read back from a CSV file; None for
+    an unseeded run, which never repeats.
+    """
+    if row.get("seed") in (None, ""):
+        return None
+    return str(row["RunId"]), str(row["seed"])
+
+
+def written_runs(output):
+    """
+    The header of the CSV `output` and the run_identity() of every seeded
+    run with rows in it.
+    """
+    with open(output, newline="") as f:
+        reader = csv.DictReader(f)
+        runs = {run_identity(row) for row in reader} - {None}
+        return reader.fieldnames, runs
+
+
+def run_jobs(
+    jobs,
+    output,
+    max_steps=1000,
+    data_collection_period=-1,
+    processes=None,
+    cache=None,
+    ensemble=False,
+):
+    """
+    Run (run_id, iteration, kwargs) jobs as run_sweep() does, appending
+    their rows to `output`, and yield the rows of each run (of each
+    parameter combination with `ensemble`) once written; rows of runs
+    already in `output` are yielded but not written again.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if isinstance(cache, str):
+        cache = ResultCache(cache)
+    if ensemble:
+        units, run = group_jobs(jobs), _run_ensemble_job
+    else:
+        units, run = [[job] for job in jobs], _run_job
+    keys = {}
+    cached = []
+    tasks = []
+    for unit in units:
+        run_id, _, kwargs = unit[0]
+        if cache is not None and not writes_outputs(kwargs):
+            if ensemble:
+                kwargs = dict(kwargs, seed=[job[2]["seed"] for job in unit])
+            keys[run_id] = run_key(kwargs, max_steps, data_collection_period)
+            rows = cache.get(keys[run_id])
+            if rows is not None:
+                cached.append(relabel(rows, unit))
+                continue
+        task = unit if ensemble else unit[0]
+        tasks.append((task, max_steps, data_collection_period))
+    write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+    header, written = (None, set()) if write_header else written_runs(output)
+    with open(output, "a", newline="") as f:
+        writer = None
+
+        def write(rows):
+            nonlocal writer
+            if writer is None:
+                fieldnames = header or list(rows[0])
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                if write_header:
+                    writer.writeheader()
+            for row in rows:
+                if row.keys() != set(writer.fieldnames):
+                    raise ValueError(
+                        f"Rows with columns {list(row)} do not fit the columns "
+                        f"{writer.fieldnames} of {output}; write to a new file"
+                    )
+            rows = [row for row in rows if run_identity(row) not in written]
+            writer.writerows(rows)
+            f.flush()
+
+        for rows in cached:
+            write(rows)
+            yield rows
+        if tasks:
+            with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+                for rows in pool.imap_unordered(run, tasks):
+                    write(rows)
+                    if cache is not None:
+                        cache.put(keys.get(rows[0]["RunId"]), rows)
+                    yield rows
@@ -0,0 +1,673 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .agent import CONDITIONS
+from .neighborhood import hex_offsets
+from .vectorized import ACTIVE, CITIZEN, COP, EMPTY, QUIESCENT
+
+# Per-cell state, double buffered: one copy is read while the next is written
+STATE = {
+    "occupant": np.int8,  # EMPTY, CITIZEN or COP
+    "agent_id": np.int64,
+    "hardship": np.float64,
+    "regime_legitimacy": np.float64,
+    "risk_aversion": np.float64,
+    "grievance": np.float64,
+    "condition": np.int8,
+    "jail_sentence": np.int64,
+    "arrest_probability": np.float64,
+}
+# Per-cell proposals exchanged between tiles within a step
+SCRATCH = {
+    "arrest_target": np.int64,
+    "arrest_key": np.float64,
+    "move_target": np.int64,
+    "move_key": np.float64,
+    "destination": np.int64,
+}
+# Agent-indexed views built from the current state, as VectorizedEngine has
+AGENT_FIELDS = (
+    "hardship",
+    "regime_legitimacy",
+    "risk_aversion",
+    "grievance",
+    "condition",
+    "jail_sentence",
+    "arrest_probability",
+)
+PHASES = ("plan", "resolve_arrests", "resolve_moves", "commit")
+
+# cells along a side of a default tile: large enough that a tile's work
+# outweighs its share of the per-phase messaging, small enough that a large
+# grid has tiles for many processes
+TILE_EDGE = 250
+
+
+class SharedArrays:
+    """
+    Named NumPy arrays of `size` elements, each in its own shared-memory
+    block. Created by the engine and attached to by name in the workers.
+    """
+
+    def __init__(self, dtypes, size, names=None):
+        self.dtypes = dtypes
+        self.size = size
+        self.blocks = {}
+        self.arrays = {}
+        for name, dtype in dtypes.items():
+            nbytes = max(np.dtype(dtype).itemsize * size, 1)
+            if names is None:
+                block = shared_memory.SharedMemory(create=True, size=nbytes)
+            else:
+                # workers share the engine's resource tracker, which
+                # unlinks the blocks if the engine dies without closing
+                block = shared_memory.SharedMemory(name=names[name])
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(size, dtype=dtype, buffer=block.buf)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def spec(self):
+        return self.dtypes, self.size, {name: b.name for name, b in self.blocks.items()}
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks = {}
+
+
+class Tile:
+    """
+    A rectangle of cells [x0, x1) x [y0, y1) plus a halo of `halo` cells on
+    every side, wrapped around the torus.
+
+    `patch` holds the flat indices of the tile and its halo (shape
+    (x1 - x0 + 2 * halo, y1 - y0 + 2 * halo)); state is gathered through it,
+    so a tile reads its neighbors' cells straight from shared memory.
+    """
+
+    def __init__(self, index, x0, x1, y0, y1, halo, width, height):
+        self.index = index
+        self.x0, self.x1, self.y0, self.y1 = x0, x1, y0, y1
+        self.halo = halo
+        xs = np.arange(x0 - halo, x1 + halo) % width
+        ys = np.arange(y0 - halo, y1 + halo) % height
+        self.patch = xs[:, None] * height + ys[None, :]
+        self.own = (slice(halo, halo + x1 - x0), slice(halo, halo + y1 - y0))
+        self.cells = self.patch[self.own]
+        self.halo_cells = np.unique(self.patch)
+
+
+class TileContext:
+    """
+    What a worker needs to step its tiles: the shared arrays, the tiles and
+    the model parameters.
+    """
+
+    def __init__(self, buffers, scratch, owner, tiles, params):
+        self.buffers = buffers
+        self.scratch = scratch
+        self.owner = owner
+        self.tiles = tiles
+        self.params = params
+        self.offsets = {
+            (vision, parity): np.array(hex_offsets(vision, parity)).reshape(-1, 2)
+            for vision in {params["citizen_vision"], params["cop_vision"]}
+            for parity in (0, 1)
+        }
+
+    def rng(self, tile, step, phase):
+        # independent of how tiles are spread over workers
+        return np.random.default_rng(
+            [self.params["seed"], step, tile.index, PHASES.index(phase)]
+        )
+
+    def neighborhood_sums(self, tile, fields, vision):
+        """
+        For every cell of the tile, the sums of `fields` (shape (F, patch))
+        over its neighborhood of `vision`.
+        """
+        nx, ny = tile.x1 - tile.x0, tile.y1 - tile.y0
+        h = tile.halo
+        sums = np.zeros((len(fields), nx, ny))
+        for parity in (0, 1):
+            # tile columns whose global x has this parity
+            start = (parity - tile.x0) % 2
+            for dx, dy in self.offsets[(vision, parity)]:
+                sums[:, start::2] += fields[
+                    :, h + start + dx : h + nx + dx : 2, h + dy : h + ny + dy
+                ]
+        return sums
+
+    def choose(self, tile, cells, vision, mask, rng):
+        """
+        For the tile cells `cells` (as (i, j) patch coordinates), a random
+        cell within `vision` where the patch-shaped `mask` is True, as flat
+        indices (EMPTY if none), and the random key it won with.
+        """
+        i, j = cells
+        chosen = np.full(len(i), EMPTY, dtype=np.int64)
+        best_keys = np.zeros(len(i))
+        for parity in (0, 1):
+            group = np.flatnonzero((tile.x0 - tile.halo + i) % 2 == parity)
+            if not len(group):
+                continue
+            offsets = self.offsets[(vision, parity)]
+            ni = i[group][:, None] + offsets[:, 0]
+            nj = j[group][:, None] + offsets[:, 1]
+            candidates = mask[ni, nj]
+            keys = rng.random(candidates.shape)
+            keys[~candidates] = -1.0
+            best = keys.argmax(1)
+            rows = np.arange(len(group))
+            found = candidates.any(1)
+            chosen[group[found]] = tile.patch[ni[rows, best], nj[rows, best]][found]
+            best_keys[group] = rng.random(len(group))
+        return chosen, best_keys
+
+    def plan(self, tile, step, current):
+        """
+        Decide, from the current state only, every agent's update in the
+        tile: citizens' new state (written to the next buffer), each cop's
+        arrestee and each free agent's destination (written as proposals).
+        """
+        cur, nxt = self.buffers[current], self.buffers[1 - current]
+        params = self.params
+        rng = self.rng(tile, step, "plan")
+        patch = tile.patch
+        occupant = cur["occupant"][patch]
+        jail = cur["jail_sentence"][patch]
+        condition = cur["condition"][patch]
+        grievance = cur["grievance"][patch]
+        free = (occupant == CITIZEN) & (jail == 0)
+        active = free & (condition == ACTIVE)
+        fields = np.stack(
+            [
+                occupant == COP,
+                active,
+                (occupant == CITIZEN) & (jail > 0),
+                occupant != EMPTY,
+                free,
+                np.where(free, grievance, 0.0),
+            ]
+        ).astype(float)
+        cops, actives, jailed, occupied, free_count, free_grievance = (
+            self.neighborhood_sums(tile, fields, params["citizen_vision"])
+        )
+
+        cells = tile.cells
+        for name in STATE:
+            nxt[name][cells] = cur[name][cells]
+        own = tile.own
+        own_occupant = occupant[own]
+        own_free = free[own]
+        own_jailed = (own_occupant == CITIZEN) & ~own_free
+        own_grievance = grievance[own]
+        # grievance smoothing over the free citizens in vision
+        smoothed = (own_grievance + free_grievance) / (1 + free_count)
+        hardship = cur["hardship"][cells]
+        legitimacy = cur["regime_legitimacy"][cells]
+        risk_aversion = cur["risk_aversion"][cells]
+        arrest_probability = 1 - np.exp(
+            -1 * params["arrest_prob_constant"] * (cops / (1 + actives))
+        )
+        adjustment = np.divide(
+            jailed, occupied, out=np.zeros_like(jailed), where=occupied > 0
+        )
+        new_grievance = hardship * (1 - np.clip(legitimacy + adjustment, 0, 1))
+        new_condition = np.where(
+            new_grievance - risk_aversion * arrest_probability
+            > params["active_threshold"],
+            ACTIVE,
+            QUIESCENT,
+        )
+        nxt["grievance"][cells[own_jailed]] = smoothed[own_jailed]
+        nxt["jail_sentence"][cells[own_jailed]] -= 1
+        nxt["grievance"][cells[own_free]] = new_grievance[own_free]
+        nxt["condition"][cells[own_free]] = new_condition[own_free]
+        nxt["arrest_probability"][cells[own_free]] = arrest_probability[own_free]
+
+        scratch = self.scratch
+        for name in ("arrest_target", "move_target", "destination"):
+            scratch[name][cells] = EMPTY
+        h = tile.halo
+        own_cops = np.nonzero(own_occupant == COP)
+        cop_cells = (own_cops[0] + h, own_cops[1] + h)
+        targets, keys = self.choose(tile, cop_cells, params["cop_vision"], active, rng)
+        scratch["arrest_target"][cells[own_cops]] = targets
+        scratch["arrest_key"][cells[own_cops]] = keys
+        if params["movement"]:
+            empty = occupant == EMPTY
+            for breed, vision in (
+                (CITIZEN, params["citizen_vision"]),
+                (COP, params["cop_vision"]),
+            ):
+                own_movers = own_free if breed == CITIZEN else own_occupant == COP
+                movers = np.nonzero(own_movers)
+                mover_cells = (movers[0] + h, movers[1] + h)
+                targets, keys = self.choose(tile, mover_cells, vision, empty, rng)
+                scratch["move_target"][cells[movers]] = targets
+                scratch["move_key"][cells[movers]] = keys
+
+    def claims(self, tile, target_name, key_name, eligible=None):
+        """
+        Proposals from the tile and its halo that target a cell of this
+        tile: (claimant cell, target cell) of the highest key per target.
+        """
+        claimants = tile.halo_cells
+        targets = self.scratch[target_name][claimants]
+        mine = targets != EMPTY
+        mine[mine] = self.owner[targets[mine]] == tile.index
+        if eligible is not None:
+            mine &= eligible(claimants)
+        claimants, targets = claimants[mine], targets[mine]
+        keys = self.scratch[key_name][claimants]
+        order = np.lexsort((-keys, targets))
+        targets = targets[order]
+        first = np.ones(len(targets), dtype=bool)
+        first[1:] = targets[1:] != targets[:-1]
+        return claimants[order][first], targets[first]
+
+    def resolve_arrests(self, tile, step, current):
+        """
+        Jail the citizens of this tile that some cop chose; when several
+        cops chose the same citizen, one arrest is made.
+        """
+        nxt = self.buffers[1 - current]
+        _, arrested = self.claims(tile, "arrest_target", "arrest_key")
+        rng = self.rng(tile, step, "resolve_arrests")
+        nxt["jail_sentence"][arrested] = rng.integers(
+            0, self.params["max_jail_term"], size=len(arrested), endpoint=True
+        )
+        nxt["condition"][arrested] = QUIESCENT
+
+    def resolve_moves(self, tile, step, current):
+        """
+        Move the winning claimant (if not just jailed) into each free cell
+        of this tile that agents chose.
+        """
+        nxt = self.buffers[1 - current]
+        movers, targets = self.claims(
+            tile,
+            "move_target",
+            "move_key",
+            eligible=lambda cells: nxt["jail_sentence"][cells] == 0,
+        )
+        for name in STATE:
+            nxt[name][targets] = nxt[name][movers]
+        self.scratch["destination"][movers] = targets
+
+    def commit(self, tile, step, current):
+        """
+        Empty the cells whose agent moved out and count the tile.
+        """
+        nxt = self.buffers[1 - current]
+        cells = tile.cells.ravel()
+        left = cells[self.scratch["destination"][cells] != EMPTY]
+        nxt["occupant"][left] = EMPTY
+        occupant = nxt["occupant"][cells]
+        citizens = occupant == CITIZEN
+        jailed = citizens & (nxt["jail_sentence"][cells] > 0)
+        active = citizens & ~jailed & (nxt["condition"][cells] == ACTIVE)
+        return np.array(
+            [
+                citizens.sum() - jailed.sum() - active.sum(),
+                active.sum(),
+                jailed.sum(),
+                (occupant == COP).sum(),
+            ]
+        )
+
+
+def _worker(connection, buffer_specs, scratch_spec, owner_spec, tiles, params):
+    buffers = [SharedArrays(*spec) for spec in buffer_specs]
+    scratch = SharedArrays(*scratch_spec)
+    owner = SharedArrays(*owner_spec)
+    context = TileContext(buffers, scratch, owner["owner"], tiles, params)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        phase, step, current = message
+        run = getattr(context, phase)
+        connection.send([run(tile, step, current) for tile in tiles])
+    for arrays in buffers + [scratch, owner]:
+        arrays.close()
+
+
+def _release(connections, processes, arrays):
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+    for shared in arrays:
+        shared.close(unlink=True)
+
+
+def default_tiles(width, height):
+    """
+    (tiles across, tiles down) of about TILE_EDGE cells a side for a grid,
+    whatever the machine, so a seed gives the same run everywhere.
+    """
+    return max(1, round(width / TILE_EDGE)), max(1, round(height / TILE_EDGE))
+
+
+class TiledEngine:
+    """
+    Domain-decomposed stepping engine for very large grids.
+
+    The lattice is split into tiles, each stepped by a worker process. Per
+    cell state lives in shared memory in two buffers: every step reads the
+    current one and writes the next, so each tile sees the state at the
+    start of the step over its halo of max(citizen_vision, cop_vision)
+    cells (wrapped around the torus) while its neighbors update theirs.
+    This is the "Simultaneous" updating scheme. A step runs four phases,
+    each on all tiles at once, with the engine waiting for every tile
+    between phases:
+
+        1. plan: citizens update their state from their neighborhood
+           (jailed ones serve a step instead), cops pick a random Active
+           citizen in vision to arrest and free agents pick a random empty
+           cell to move to; picks are written as proposals with a random key,
+        2. resolve_arrests: the tile owning each chosen citizen jails it once,
+        3. resolve_moves: the tile owning each chosen cell moves in the
+           claimant with the highest key, unless it was just jailed, copying
+           its record across tiles if needed,
+        4. commit: tiles empty the cells that were moved out of and report
+           their counts.
+
+    Every contested arrest or cell is decided by the one tile that owns it,
+    so no two workers ever write the same cell. Random numbers depend only
+    on the seed, step, tile and phase, so results do not depend on the
+    number of processes, but do depend on the tiling: the tiles are part of
+    what a seed reproduces, and the default tiling follows the grid size
+    alone (see default_tiles). Tiles are dealt round-robin to the processes,
+    so a grid of fewer tiles than processes leaves some of them unused.
+
+    Only the stepping is split: the model still builds a Citizen or Cop
+    object per agent before the engine takes over, so build time and memory
+    grow with the grid as for the other engines (the benchmark's "scaling"
+    suite measures both against the number of processes).
+
+    With processes=0 the tiles are stepped in the calling process.
+    """
+
+    def __init__(self, model, tiles=None, processes=None):
+        """
+        Build the engine from the agents currently on the model's schedule.
+        Args:
+            model: EpsteinCivilViolence instance on a torus of even width
+            tiles: (tiles across, tiles down); defaults to
+                default_tiles(width, height). Part of the run's identity: the
+                same seed with other tiles gives another run.
+            processes: worker processes, defaults to the number of CPUs; 0
+                steps the tiles in this process
+        """
+        width, height = model.width, model.height
+        halo = max(model.citizen_vision, model.cop_vision)
+        if width % 2 or min(width, height) < 2 * halo + 1:
+            raise ValueError(
+                "The tiled engine needs a grid of even width and at least "
+                "2 * vision + 1 cells in each direction"
+            )
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if tiles is None:
+            tiles = default_tiles(width, height)
+        self.model = model
+        self.width = width
+        self.height = height
+        self.current = 0
+        n = width * height
+        self.buffers = [SharedArrays(STATE, n), SharedArrays(STATE, n)]
+        self.scratch = SharedArrays(SCRATCH, n)
+        owner = SharedArrays({"owner": np.int32}, n)
+        self.owner = owner
+
+        cur = self.buffers[0]
+        cur["occupant"][:] = EMPTY
+        self.agents = sorted(model.schedule.agents, key=lambda a: a.unique_id)
+        self._agents_by_id = {agent.unique_id: agent for agent in self.agents}
+        for agent in self.agents:
+            x, y = agent.pos
+            cell = x * height + y
+            cur["agent_id"][cell] = agent.unique_id
+            if agent.breed == "cop":
+                cur["occupant"][cell] = COP
+                cur["condition"][cell] = QUIESCENT
+                cur["jail_sentence"][cell] = 0
+                cur["arrest_probability"][cell] = np.nan
+                continue
+            cur["occupant"][cell] = CITIZEN
+            cur["hardship"][cell] = agent.hardship
+            cur["regime_legitimacy"][cell] = agent.regime_legitimacy
+            cur["risk_aversion"][cell] = agent.risk_aversion
+            cur["grievance"][cell] = agent.grievance
+            cur["condition"][cell] = agent.condition_code
+            cur["jail_sentence"][cell] = agent.jail_sentence
+            cur["arrest_probability"][cell] = (
+                np.nan if agent.arrest_probability is None else agent.arrest_probability
+            )
+
+        across, down = tiles
+        xs = np.linspace(0, width, across + 1).astype(int)
+        ys = np.linspace(0, height, down + 1).astype(int)
+        self.tiles = []
+        for i in range(across):
+            for j in range(down):
+                tile = Tile(
+                    len(self.tiles), xs[i], xs[i + 1], ys[j], ys[j + 1], halo, width, height
+                )
+                owner["owner"][tile.cells.ravel()] = tile.index
+                self.tiles.append(tile)
+        seed = model.seed
+        params = {
+            "citizen_vision": model.citizen_vision,
+            "cop_vision": model.cop_vision,
+            "arrest_prob_constant": model.arrest_prob_constant,
+            "active_threshold": model.active_threshold,
+            "max_jail_term": model.max_jail_term,
+            "movement": model.movement,
+            "seed": seed if isinstance(seed, int) else int(model.rng.integers(2**63)),
+        }
+        self.context = TileContext(
+            self.buffers, self.scratch, owner["owner"], self.tiles, params
+        )
+        self.connections = []
+        self.processes = []
+        if processes:
+            mp = multiprocessing.get_context("spawn")
+            groups = [self.tiles[k::processes] for k in range(processes)]
+            for group in groups:
+                if not group:
+                    continue
+                parent, child = mp.Pipe()
+                process = mp.Process(
+                    target=_worker,
+                    args=(
+                        child,
+                        [b.spec() for b in self.buffers],
+                        self.scratch.spec(),
+                        owner.spec(),
+                        group,
+                        params,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                self.connections.append(parent)
+                self.processes.append(process)
+        self._finalizer = weakref.finalize(
+            self,
+            _release,
+            self.connections,
+            self.processes,
+            self.buffers + [self.scratch, owner],
+        )
+        self.closed = False
+        self._tally = None
+        self._agent_arrays = None
+
+    def run_phase(self, phase):
+        # the model's step count, so a restored run draws the same numbers
+        step = self.model.schedule.steps
+        if not self.connections:
+            run = getattr(self.context, phase)
+            return [run(tile, step, self.current) for tile in self.tiles]
+        for connection in self.connections:
+            connection.send((phase, step, self.current))
+        results = []
+        for connection in self.connections:
+            results.extend(connection.recv())
+        return results
+
+    def step(self):
+        """
+        Advance every agent by one tick.
+        """
+        if self.closed:
+            raise RuntimeError("The tiled engine has been closed")
+        for phase in PHASES[:-1]:
+            self.run_phase(phase)
+        counts = np.sum(self.run_phase("commit"), axis=0)
+        self.current = 1 - self.current
+        self._tally = dict(
+            zip(("Quiescent", "Active", "Jailed", "Cops"), counts.tolist())
+        )
+        self._agent_arrays = None
+
+    def state(self, name):
+        """
+        The current per-cell array `name`.
+        """
+        return self.buffers[self.current][name]
+
+    def tally(self):
+        """
+        Counts of free Quiescent and Active citizens, jailed citizens and
+        cops.
+        """
+        if self._tally is None:
+            occupant = self.state("occupant")
+            citizens = occupant == CITIZEN
+            jailed = citizens & (self.state("jail_sentence") > 0)
+            active = citizens & ~jailed & (self.state("condition") == ACTIVE)
+            self._tally = {
+                "Quiescent": int(citizens.sum() - jailed.sum() - active.sum()),
+                "Active": int(active.sum()),
+                "Jailed": int(jailed.sum()),
+                "Cops": int((occupant == COP).sum()),
+            }
+        return self._tally
+
+    def count_type_citizens(self, condition, exclude_jailed=True):
+        mask = (self.state("occupant") == CITIZEN) & (
+            self.state("condition") == CONDITIONS.index(condition)
+        )
+        if exclude_jailed:
+            mask &= self.state("jail_sentence") == 0
+        return int(mask.sum())
+
+    def agent_arrays(self):
+        """
+        The current state indexed by agent (ordered by unique id, as
+        `agents`), in the layout of VectorizedEngine.
+        """
+        if self._agent_arrays is None:
+            cells = np.flatnonzero(self.state("occupant") != EMPTY)
+            position = cells[np.argsort(self.state("agent_id")[cells], kind="stable")]
+            arrays = {"position": position, "breed": self.state("occupant")[position]}
+            for name in AGENT_FIELDS:
+                arrays[name] = self.state(name)[position]
+            self._agent_arrays = arrays
+        return self._agent_arrays
+
+    @property
+    def position(self):
+        return self.agent_arrays()["position"]
+
+    @property
+    def breed(self):
+        return self.agent_arrays()["breed"]
+
+    @property
+    def hardship(self):
+        return self.agent_arrays()["hardship"]
+
+    @property
+    def regime_legitimacy(self):
+        return self.agent_arrays()["regime_legitimacy"]
+
+    @property
+    def risk_aversion(self):
+        return self.agent_arrays()["risk_aversion"]
+
+    @property
+    def grievance(self):
+        return self.agent_arrays()["grievance"]
+
+    @property
+    def condition(self):
+        return self.agent_arrays()["condition"]
+
+    @property
+    def jail_sentence(self):
+        return self.agent_arrays()["jail_sentence"]
+
+    @property
+    def arrest_probability(self):
+        return self.agent_arrays()["arrest_probability"]
+
+    def adjust_legitimacy(self, shock):
+        """
+        Shift every citizen's regime legitimacy by `shock`, clipped to [0, 1].
+        """
+        citizens = self.state("occupant") == CITIZEN
+        legitimacy = self.state("regime_legitimacy")
+        legitimacy[citizens] = np.clip(legitimacy[citizens] + shock, 0, 1)
+        self._agent_arrays = None
+
+    def sync_agents(self):
+        """
+        Write the current state back to the Citizen/Cop objects and the grid.
+        """
+        grid = self.model.grid
+        arrays = self.agent_arrays()
+        for agent in self.agents:
+            grid.remove_agent(agent)
+        for i, agent in enumerate(self.agents):
+            pos = divmod(int(arrays["position"][i]), self.height)
+            grid.place_agent(agent, pos)
+            if arrays["breed"][i] == COP:
+                agent.neighbors_clock = None
+                continue
+            agent.grievance = float(arrays["grievance"][i])
+            agent.regime_legitimacy = float(arrays["regime_legitimacy"][i])
+            agent.condition = CONDITIONS[arrays["condition"][i]]
+            agent.jail_sentence = int(arrays["jail_sentence"][i])
+            if not np.isnan(arrays["arrest_probability"][i]):
+                agent.arrest_probability = float(arrays["arrest_probability"][i])
+        self.model.neighborhoods.occupied[:] = self.state("occupant") != EMPTY
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory. The final state stays
+        readable, but the engine can no longer step.
+        """
+        if self.closed:
+            return
+        final = {name: self.state(name).copy() for name in STATE}
+        self._finalizer()
+        self.buffers = [final, final]
+        self.closed = True
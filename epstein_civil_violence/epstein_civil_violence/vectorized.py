@@ -0,0 +1,446 @@
+import numpy as np
+
+from .agent import CONDITIONS, Citizen, Cop
+from .profiling import ACTIVATION, ARRESTS, GRIEVANCE, MOVEMENT
+
+CITIZEN = Citizen.breed_code
+COP = Cop.breed_code
+
+QUIESCENT = CONDITIONS.index("Quiescent")
+ACTIVE = CONDITIONS.index("Active")
+
+EMPTY = -1
+
+# what a step's random numbers are drawn for; with the attempt they name a
+# draw, see VectorizedEngine.uniform
+DRAWS = ("order", "arrest", "arrest_claims", "jail", "move", "move_claims")
+
+MASK = 2**64 - 1
+
+
+def mix(x):
+    """
+    splitmix64's finalizer: a well-spread 64-bit hash of each element of the
+    uint64 array `x` (of the int `x` when given one).
+    """
+    if isinstance(x, int):
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+        return x ^ (x >> 31)
+    x = x ^ (x >> 30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> 27
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> 31
+    return x
+
+
+def agent_keys(seed, n):
+    """
+    The random stream keys of the `n` agents of a run with `seed` (anything
+    numpy.random.SeedSequence takes).
+    """
+    key = int(np.random.SeedSequence(seed).generate_state(1, np.uint64)[0])
+    return mix(np.uint64(key) ^ mix(np.arange(n, dtype=np.uint64)))
+
+
+class VectorizedEngine:
+    """
+    Array-backed stepping engine for EpsteinCivilViolence.
+
+    Citizen and cop state lives in NumPy arrays indexed by agent, and the
+    lattice is a flat array holding the index of the agent in each cell (or
+    EMPTY). A step updates all agents in batched array operations:
+
+        1. grievance smoothing over free citizen neighbors (whole lattice),
+        then, batch by batch,
+        2. jailed citizens serve one step of their term,
+        3. free citizens estimate arrest probability and (de)activate,
+        4. cops arrest at most one active citizen in vision each,
+        5. free citizens and cops move to a random empty cell in vision.
+
+    The random numbers of a step are counter-based: each is a hash of the
+    run's seed, the agent it is for, the step and what it is drawn for (see
+    uniform), so an agent's draws do not depend on what other agents draw,
+    and each kind of draw is one array operation over all agents per step.
+
+    Random activation is approximated by shuffling the agents once per tick
+    and splitting them into `batches` equal groups that are stepped in turn:
+    within a group agents act simultaneously on the state left by the
+    previous group, and conflicts (two cops picking the same rebel, two
+    agents picking the same cell) are resolved in random order. More batches
+    track the one-agent-at-a-time mesa schedule more closely at the cost of
+    more, smaller array operations.
+
+    The engine reads neighbors from the fixed-width tables of
+    HexNeighborhoodIndex.table, so the grid must have an even width and at
+    least 2 * vision + 1 cells in each direction (the model checks this).
+
+    The model's schedule_type picks the order: "Random" as above, "Base"
+    with the batches in fixed agent order, and "Staged" and "Simultaneous"
+    as a single group over all agents (see step_stages).
+
+    Attributes:
+        breed: CITIZEN or COP per agent
+        position: flat cell index (x * height + y) per agent
+        hardship, regime_legitimacy, risk_aversion, grievance: citizen state
+        condition: QUIESCENT or ACTIVE per agent
+        jail_sentence: remaining jail term per agent
+        arrest_probability: last estimate per agent (NaN until computed)
+        cell_agent: agent index per cell, EMPTY if the cell is free
+        keys: random stream key per agent, see agent_keys
+    """
+
+    def __init__(self, model, batches=8):
+        """
+        Build the engine from the agents currently on the model's schedule.
+        Args:
+            model: EpsteinCivilViolence instance
+            batches: number of activation groups per tick
+        """
+        self.model = model
+        self.batches = batches
+        self.width = model.width
+        self.height = model.height
+        self.agents = list(model.schedule.agents)
+        n = len(self.agents)
+        self.keys = agent_keys(model.seed, n)
+        self.breed = np.empty(n, dtype=np.int8)
+        self.position = np.empty(n, dtype=np.int64)
+        self.hardship = np.zeros(n)
+        self.regime_legitimacy = np.zeros(n)
+        self.risk_aversion = np.zeros(n)
+        self.grievance = np.zeros(n)
+        self.condition = np.zeros(n, dtype=np.int8)
+        self.jail_sentence = np.zeros(n, dtype=np.int64)
+        self.arrest_probability = np.full(n, np.nan)
+        for i, agent in enumerate(self.agents):
+            x, y = agent.pos
+            self.position[i] = x * self.height + y
+            if agent.breed == "cop":
+                self.breed[i] = COP
+                continue
+            self.breed[i] = CITIZEN
+            self.hardship[i] = agent.hardship
+            self.regime_legitimacy[i] = agent.regime_legitimacy
+            self.risk_aversion[i] = agent.risk_aversion
+            self.grievance[i] = agent.grievance
+            self.condition[i] = agent.condition_code
+            self.jail_sentence[i] = agent.jail_sentence
+            if agent.arrest_probability is not None:
+                self.arrest_probability[i] = agent.arrest_probability
+        self.is_citizen = self.breed == CITIZEN
+        self.is_cop = ~self.is_citizen
+        self.n_cells = self.width * self.height
+        self.cell_agent = np.full(self.n_cells, EMPTY, dtype=np.int64)
+        self.cell_agent[self.position] = np.arange(n)
+        self.citizen_table = model.neighborhoods.table(model.citizen_vision)
+        self.cop_table = model.neighborhoods.table(model.cop_vision)
+        # the step the uniform() columns in `draws` were computed for
+        self.draws_step = None
+        self.draws = {}
+
+    def step(self):
+        """
+        Advance every agent by one tick. With the model's profiler on, the
+        grievance pass, citizen updates (arrest probability and activation
+        together), arrests and moves are timed as phases.
+        """
+        profiler = self.model.profiler
+        if profiler:
+            profiler.start()
+        self.smooth_grievance()
+        if profiler:
+            profiler.lap(GRIEVANCE)
+        schedule_type = self.model.schedule_type
+        if schedule_type in ("Staged", "Simultaneous"):
+            self.step_stages(frozen=schedule_type == "Simultaneous")
+            return
+        for batch in self.activation_groups():
+            citizens = batch[self.is_citizen[batch]]
+            serving = self.jail_sentence[citizens] > 0
+            self.jail_sentence[citizens[serving]] -= 1
+            free = citizens[~serving]
+            self.update_citizens(free)
+            if profiler:
+                profiler.lap(ACTIVATION)
+            cops = batch[self.is_cop[batch]]
+            self.arrest(cops)
+            if profiler:
+                profiler.lap(ARRESTS)
+            if self.model.movement:
+                self.move(np.concatenate([free, cops]))
+                if profiler:
+                    profiler.lap(MOVEMENT)
+
+    def step_stages(self, frozen):
+        """
+        Staged and simultaneous updating: all citizens update (or serve jail
+        time), then all cops arrest, then every agent still free moves.
+        With `frozen`, the citizen updates all read the state at the start of
+        the step and cops arrest the citizens that were Active then, so every
+        decision is made from one snapshot before any is applied.
+        """
+        profiler = self.model.profiler
+        citizens = np.flatnonzero(self.is_citizen)
+        serving = citizens[self.jail_sentence[citizens] > 0]
+        free = citizens[self.jail_sentence[citizens] == 0]
+        cops = np.flatnonzero(self.is_cop)
+        active = self.active_cells() if frozen else None
+        if frozen:
+            self.update_citizens(free)
+            self.jail_sentence[serving] -= 1
+        else:
+            self.jail_sentence[serving] -= 1
+            self.update_citizens(free)
+        if profiler:
+            profiler.lap(ACTIVATION)
+        self.arrest(cops, active)
+        if profiler:
+            profiler.lap(ARRESTS)
+        if self.model.movement:
+            free = free[self.jail_sentence[free] == 0]
+            self.move(np.concatenate([free, cops]))
+            if profiler:
+                profiler.lap(MOVEMENT)
+
+    def uniform(self, agents, draw, attempt=0):
+        """
+        A uniform number in [0, 1) for each of `agents`: a hash of the
+        agent's key, the model's step, `draw` (one of DRAWS) and `attempt`.
+        An agent takes part in one activation group per step, so it draws at
+        most once per name; a name's numbers are computed for every agent at
+        once, on its first use in the step.
+        """
+        step = self.model.schedule.steps
+        if step != self.draws_step:
+            self.draws_step = step
+            self.draws = {}
+        column = self.draws.get((draw, attempt))
+        if column is None:
+            name = mix(mix(step) ^ (DRAWS.index(draw) | attempt << 8))
+            bits = mix(self.keys ^ np.uint64(name))
+            column = self.draws[draw, attempt] = (bits >> 11) * (1.0 / 2**53)
+        return column[agents]
+
+    def activation_groups(self):
+        """
+        The agent indices of each activation group of a tick, in turn: the
+        agents in fixed order for "Base", else shuffled, split into
+        `batches` groups.
+        """
+        agents = np.arange(len(self.breed))
+        if self.model.schedule_type != "Base":
+            agents = np.argsort(self.uniform(agents, "order"), kind="stable")
+        return np.array_split(agents, self.batches)
+
+    def neighbors(self, table, cells):
+        """
+        The neighbor cells of each of `cells` by a neighborhood table, one
+        column per cell.
+        """
+        return table[:, cells]
+
+    def cell_field(self, mask, values=1):
+        """
+        Scatter a per-agent mask (optionally weighted by `values`) onto the
+        lattice.
+        """
+        field = np.zeros(self.n_cells)
+        field[self.position[mask]] = values if np.isscalar(values) else values[mask]
+        return field
+
+    def free_citizens(self):
+        return self.is_citizen & (self.jail_sentence == 0)
+
+    def smooth_grievance(self):
+        """
+        Replace each citizen's grievance by the mean over itself and the free
+        citizens in vision.
+        """
+        citizens = np.flatnonzero(self.is_citizen)
+        free = self.free_citizens()
+        sub = self.neighbors(self.citizen_table, self.position[citizens])
+        total = self.grievance[citizens] + self.cell_field(free, self.grievance)[sub].sum(0)
+        count = 1 + self.cell_field(free)[sub].sum(0)
+        self.grievance[citizens] = total / count
+
+    def update_citizens(self, citizens):
+        """
+        Estimate arrest probability, adjust legitimacy by jailed neighbors and
+        decide the condition of the given citizens.
+        """
+        if not len(citizens):
+            return
+        free = self.free_citizens()
+        sub = self.neighbors(self.citizen_table, self.position[citizens])
+        cops = self.cell_field(self.is_cop)[sub].sum(0)
+        actives = 1 + self.cell_field(free & (self.condition == ACTIVE))[sub].sum(0)
+        jailed = self.cell_field(self.is_citizen & ~free)[sub].sum(0)
+        occupied = (self.cell_agent[sub] != EMPTY).sum(0)
+        self.arrest_probability[citizens] = 1 - np.exp(
+            -1 * self.model.arrest_prob_constant * (cops / actives)
+        )
+        adjustment = np.divide(
+            jailed, occupied, out=np.zeros(len(citizens)), where=occupied > 0
+        )
+        adjusted_legitimacy = np.clip(
+            self.regime_legitimacy[citizens] + adjustment, 0, 1
+        )
+        self.grievance[citizens] = self.hardship[citizens] * (1 - adjusted_legitimacy)
+        net_risk = self.risk_aversion[citizens] * self.arrest_probability[citizens]
+        self.condition[citizens] = np.where(
+            self.grievance[citizens] - net_risk > self.model.active_threshold,
+            ACTIVE,
+            QUIESCENT,
+        )
+
+    def choose(self, table, agents, candidates, draw, attempt):
+        """
+        For each of `agents`, pick a uniformly random cell in vision (by
+        `table`) for which `candidates` (a boolean lattice) is True, by the
+        uniform() `draw` and `attempt`. Returns EMPTY where there is no
+        candidate.
+        """
+        sub = self.neighbors(table, self.position[agents])
+        seen = candidates[sub].cumsum(0)
+        count = seen[-1]
+        pick = (self.uniform(agents, draw, attempt) * count).astype(count.dtype)
+        # the row of the pick-th candidate (from 0) of each column
+        best = (seen > pick).argmax(0)
+        chosen = sub[best, np.arange(len(agents))]
+        chosen[count == 0] = EMPTY
+        return chosen
+
+    def first_claims(self, targets, agents, draw, attempt):
+        """
+        Given one target per claimant in `agents` (EMPTY for none), return
+        the claimant positions that win their target, visiting claimants in
+        the random order of the uniform() `draw` and `attempt`.
+        """
+        claimants = np.flatnonzero(targets != EMPTY)
+        keys = self.uniform(agents[claimants], draw, attempt)
+        order = np.argsort(keys, kind="stable")
+        claimants = claimants[order]
+        _, first = np.unique(targets[claimants], return_index=True)
+        return claimants[first]
+
+    def active_cells(self):
+        """
+        Boolean lattice of the cells holding a free Active citizen.
+        """
+        active = self.free_citizens() & (self.condition == ACTIVE)
+        return self.cell_field(active).astype(bool)
+
+    def arrest(self, cops, active=None):
+        """
+        Each of `cops` arrests at most one free active citizen in vision.
+        Args:
+            cops: indices of the arresting cops
+            active: cells of the citizens that may be arrested; defaults to
+                those currently Active
+        """
+        if active is None:
+            active = self.active_cells()
+        else:
+            active = active.copy()
+        attempt = 0
+        while len(cops) and active.any():
+            targets = self.choose(self.cop_table, cops, active, "arrest", attempt)
+            winners = self.first_claims(targets, cops, "arrest_claims", attempt)
+            if not len(winners):
+                break
+            arrested = self.cell_agent[targets[winners]]
+            terms = self.uniform(arrested, "jail")
+            self.jail_sentence[arrested] = (
+                terms * (self.model.max_jail_term + 1)
+            ).astype(np.int64)
+            self.condition[arrested] = QUIESCENT
+            active[targets[winners]] = False
+            # cops that lost a contested arrest try again
+            retry = np.ones(len(cops), dtype=bool)
+            retry[winners] = False
+            retry &= targets != EMPTY
+            cops = cops[retry]
+            attempt += 1
+
+    def move(self, movers, rounds=3):
+        """
+        Move each of `movers` to a random empty cell in vision. Agents that
+        lose a contested cell retry on the cells vacated by the winners.
+        """
+        for attempt in range(rounds):
+            if not len(movers):
+                return
+            empty = self.cell_agent == EMPTY
+            targets = np.full(len(movers), EMPTY, dtype=np.int64)
+            for table, breed in (
+                (self.citizen_table, CITIZEN),
+                (self.cop_table, COP),
+            ):
+                group = self.breed[movers] == breed
+                if group.any():
+                    targets[group] = self.choose(
+                        table, movers[group], empty, "move", attempt
+                    )
+            winners = self.first_claims(targets, movers, "move_claims", attempt)
+            moved = movers[winners]
+            self.cell_agent[self.position[moved]] = EMPTY
+            self.position[moved] = targets[winners]
+            self.cell_agent[self.position[moved]] = moved
+            retry = np.ones(len(movers), dtype=bool)
+            retry[winners] = False
+            retry &= targets != EMPTY
+            movers = movers[retry]
+
+    def adjust_legitimacy(self, shock):
+        """
+        Shift every citizen's regime legitimacy by `shock`, clipped to [0, 1].
+        """
+        self.regime_legitimacy[self.is_citizen] = np.clip(
+            self.regime_legitimacy[self.is_citizen] + shock, 0, 1
+        )
+
+    def count_type_citizens(self, condition, exclude_jailed=True):
+        code = CONDITIONS.index(condition)
+        mask = self.is_citizen & (self.condition == code)
+        if exclude_jailed:
+            mask &= self.jail_sentence == 0
+        return int(mask.sum())
+
+    def tally(self):
+        """
+        Counts of free Quiescent and Active citizens, jailed citizens and
+        cops.
+        """
+        free = self.free_citizens()
+        n_free = int(free.sum())
+        active = int((free & (self.condition == ACTIVE)).sum())
+        n_citizens = int(self.is_citizen.sum())
+        return {
+            "Quiescent": n_free - active,
+            "Active": active,
+            "Jailed": n_citizens - n_free,
+            "Cops": len(self.breed) - n_citizens,
+        }
+
+    def sync_agents(self):
+        """
+        Write the array state back to the Citizen/Cop objects and the grid,
+        e.g. before handing the model to the visualization.
+        """
+        grid = self.model.grid
+        for agent in self.agents:
+            grid.remove_agent(agent)
+        for i, agent in enumerate(self.agents):
+            grid.place_agent(agent, tuple(divmod(int(self.position[i]), self.height)))
+            if self.breed[i] == COP:
+                agent.neighbors_clock = None
+                continue
+            agent.grievance = float(self.grievance[i])
+            agent.regime_legitimacy = float(self.regime_legitimacy[i])
+            agent.condition = CONDITIONS[self.condition[i]]
+            agent.jail_sentence = int(self.jail_sentence[i])
+            if not np.isnan(self.arrest_probability[i]):
+                agent.arrest_probability = float(self.arrest_probability[i])
+        self.model.neighborhoods.occupied[:] = self.cell_agent != EMPTY
@@ -0,0 +1,3 @@
+from epstein_civil_violence.live_server import server
+
+server.launch(open_browser=True)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from epstein_civil_violence import aggregates
+from epstein_civil_violence.model import EpsteinCivilViolence
+from epstein_civil_violence.vectorized import ACTIVE, EMPTY
+
+PARAMETERS = dict(width=12, height=12, citizen_vision=2, cop_vision=3, seed=5)
+SCHEDULES = ["Random", "Base", "Staged", "Simultaneous"]
+
+
+def recount(model, vision):
+    """
+    The aggregate table for `vision`, counted cell by cell from the grid.
+    """
+    grid = model.grid
+    by_cell = {agent.pos: agent for agent in model.schedule.agents}
+    totals = np.zeros((model.width * model.height, aggregates.FIELDS))
+    for x in range(model.width):
+        for y in range(model.height):
+            row = totals[x * model.height + y]
+            cells = grid.get_neighborhood((x, y), include_center=False, radius=vision)
+            for pos in cells:
+                agent = by_cell.get(pos)
+                if agent is not None:
+                    row += aggregates.contribution(agent)
+    return totals
+
+
+def run(model, steps=6):
+    """
+    Step `model`, checking its running tally against a recount each step.
+    """
+    for _ in range(steps):
+        model.step()
+        if model.vectorized is not None:
+            # the Citizen/Cop objects only follow the arrays when synced
+            model.vectorized.sync_agents()
+        assert model.tally() == model.count_agents(model)
+
+
+@pytest.mark.parametrize("schedule_type", SCHEDULES + ["ActiveSet"])
+def test_aggregates_match_recount(schedule_type):
+    model = EpsteinCivilViolence(schedule_type=schedule_type, **PARAMETERS)
+    run(model)
+    for vision in (model.citizen_vision, model.cop_vision):
+        assert np.allclose(model.aggregates.totals[vision], recount(model, vision))
+
+
+@pytest.mark.parametrize("schedule_type", SCHEDULES)
+def test_vectorized_counts_match_recount(schedule_type):
+    model = EpsteinCivilViolence(
+        engine="vectorized", schedule_type=schedule_type, **PARAMETERS
+    )
+    run(model)
+    engine = model.vectorized
+    free = engine.free_citizens()
+    fields = {
+        aggregates.COPS: engine.cell_field(engine.is_cop),
+        aggregates.ACTIVE: engine.cell_field(free & (engine.condition == ACTIVE)),
+        aggregates.JAILED: engine.cell_field(engine.is_citizen & ~free),
+        aggregates.OCCUPIED: (engine.cell_agent != EMPTY).astype(float),
+        aggregates.FREE_CITIZENS: engine.cell_field(free),
+        aggregates.GRIEVANCE: engine.cell_field(free, engine.grievance),
+    }
+    for vision, table in (
+        (model.citizen_vision, engine.citizen_table),
+        (model.cop_vision, engine.cop_table),
+    ):
+        expected = recount(model, vision)
+        for field, values in fields.items():
+            assert np.allclose(values[table].sum(0), expected[:, field])
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from epstein_civil_violence.checkpoint import agent_state, restore, snapshot
+from epstein_civil_violence.model import EpsteinCivilViolence
+
+PARAMETERS = dict(
+    width=20,
+    height=20,
+    seed=5,
+    max_jail_term=10,
+    legitimacy_distribution="normal",
+    legitimacy_param_normal_mean=0.2,
+)
+
+
+@pytest.mark.parametrize(
+    "engine, schedule_type",
+    [("agents", "Random"), ("vectorized", "Random"), ("agents", "ActiveSet")],
+)
+def test_restored_run_continues_exactly(engine, schedule_type):
+    model = EpsteinCivilViolence(
+        engine=engine, schedule_type=schedule_type, **PARAMETERS
+    )
+    for _ in range(10):
+        model.step()
+    restored = restore(snapshot(model))
+    for _ in range(15):
+        model.step()
+        restored.step()
+    original, copy = agent_state(model), agent_state(restored)
+    for name in ("unique_id", "position", "condition", "jail_sentence", "grievance"):
+        assert np.array_equal(original[name], copy[name])
+    series = model.datacollector.get_model_vars_dataframe()
+    assert series.equals(restored.datacollector.get_model_vars_dataframe())
+    assert len(series) == 26
@@ -0,0 +1,32 @@
+import argparse
+
+import pytest
+
+from epstein_civil_violence.cli import add_model_arguments
+from epstein_civil_violence.model import EpsteinCivilViolence
+
+
+def parse(*args):
+    parser = argparse.ArgumentParser()
+    add_model_arguments(parser, EpsteinCivilViolence)
+    return vars(parser.parse_args(args))
+
+
+def test_options_typed_by_parameter():
+    args = parse(
+        *"--columnar-output 2024 --seed 7 --tiles (2,3) --processes 0".split(),
+        *"--movement false --cop-density 0.1".split(),
+    )
+    assert args == {
+        "columnar_output": "2024",
+        "seed": 7,
+        "tiles": (2, 3),
+        "processes": 0,
+        "movement": False,
+        "cop_density": 0.1,
+    }
+
+
+def test_malformed_literal_is_an_error():
+    with pytest.raises(SystemExit):
+        parse("--tiles", "two by two")
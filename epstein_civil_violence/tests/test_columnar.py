@@ -0,0 +1,40 @@
+import pytest
+
+from epstein_civil_violence.model import EpsteinCivilViolence
+from epstein_civil_violence.sweep import run_job
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+PARAMETERS = dict(width=10, height=10, citizen_vision=2, cop_vision=2, seed=1)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_files_readable_after_close(tmp_path, file_format):
+    with EpsteinCivilViolence(
+        columnar_output=str(tmp_path), columnar_format=file_format, **PARAMETERS
+    ) as model:
+        for _ in range(5):
+            model.step()
+        assert model.running
+    read = pd.read_parquet if file_format == "parquet" else pd.read_feather
+    frame = read(tmp_path / f"model.{file_format}")
+    assert frame["Step"].tolist() == list(range(6))
+    agents = read(tmp_path / f"agents.{file_format}")
+    assert agents["Step"].nunique() == 6
+
+
+def test_stream_closes_on_early_exit(tmp_path):
+    model = EpsteinCivilViolence(columnar_output=str(tmp_path), **PARAMETERS)
+    for record in model.iter_steps():
+        if record.step == 3:
+            break
+    frame = pd.read_parquet(tmp_path / "model.parquet")
+    assert frame["Step"].tolist() == [0, 1, 2, 3]
+
+
+def test_run_job_closes_short_run(tmp_path):
+    kwargs = dict(PARAMETERS, columnar_output=str(tmp_path), max_iters=1000)
+    run_job((0, 0, kwargs), max_steps=4, data_collection_period=-1)
+    frame = pd.read_parquet(tmp_path / "run_0_seed_1" / "model.parquet")
+    assert len(frame) == 6
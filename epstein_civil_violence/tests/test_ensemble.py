@@ -0,0 +1,37 @@
+import pytest
+
+from epstein_civil_violence.ensemble import SERIES, Ensemble
+from epstein_civil_violence.model import EpsteinCivilViolence
+
+PARAMETERS = dict(
+    width=12,
+    height=12,
+    citizen_vision=2,
+    cop_vision=2,
+    max_jail_term=10,
+    max_iters=110,
+    international_aid="Aid Rebellion",
+    shock_amount=0.3,
+)
+
+
+@pytest.mark.parametrize("schedule_type", ["Random", "Base", "Simultaneous"])
+def test_replicates_match_their_own_runs(schedule_type):
+    ensemble = Ensemble(replicates=3, seed=4, schedule_type=schedule_type, **PARAMETERS)
+    series = ensemble.run()
+    for r, seed in enumerate(ensemble.seeds):
+        model = EpsteinCivilViolence(
+            seed=seed, engine="vectorized", schedule_type=schedule_type, **PARAMETERS
+        )
+        while model.running:
+            model.step()
+        frame = model.datacollector.get_model_vars_dataframe()
+        for name in SERIES:
+            assert frame[name].tolist() == series[name][:, r].tolist()
+
+
+@pytest.mark.parametrize("width, height", [(11, 12), (10, 10)])
+def test_grid_unfit_for_the_vectorized_engine_is_rejected(width, height):
+    parameters = dict(PARAMETERS, width=width, height=height, cop_vision=5)
+    with pytest.raises(ValueError, match="even width"):
+        Ensemble(replicates=2, seed=1, **parameters)
@@ -0,0 +1,53 @@
+import mesa
+import numpy as np
+import pytest
+
+from epstein_civil_violence.neighborhood import HexNeighborhoodIndex, hex_offsets
+
+
+def grid_neighborhood(grid, pos, vision):
+    return sorted(
+        x * grid.height + y
+        for x, y in grid.get_neighborhood(pos, include_center=False, radius=vision)
+        if (x, y) != pos
+    )
+
+
+@pytest.mark.parametrize(
+    "width, height, vision",
+    [(10, 10, 1), (10, 10, 3), (12, 7, 2), (16, 20, 7), (8, 8, 4), (11, 11, 2)],
+)
+def test_index_matches_grid_neighborhood(width, height, vision):
+    grid = mesa.space.HexGrid(width, height, torus=True)
+    index = HexNeighborhoodIndex(grid)
+    for x in range(width):
+        for y in range(height):
+            expected = grid_neighborhood(grid, (x, y), vision)
+            assert index.cell_indices((x, y), vision).tolist() == expected
+            assert index.size((x, y), vision) == len(expected)
+    if index.has_table(vision):
+        table = index.table(vision)
+        for cell in range(width * height):
+            pos = index.coordinates(cell)
+            assert table[:, cell].tolist() == grid_neighborhood(grid, pos, vision)
+
+
+@pytest.mark.parametrize("vision", [1, 2, 5])
+@pytest.mark.parametrize("x", [4, 5])
+def test_offsets_match_grid_neighborhood(vision, x):
+    grid = mesa.space.HexGrid(20, 20, torus=True)
+    y = 9
+    cells = {((x + dx) % 20, (y + dy) % 20) for dx, dy in hex_offsets(vision, x % 2)}
+    assert len(cells) == len(hex_offsets(vision, x % 2))
+    expected = set(grid.get_neighborhood((x, y), include_center=False, radius=vision))
+    assert cells == expected
+
+
+@pytest.mark.parametrize(
+    "width, height, vision", [(10, 10, 3), (12, 7, 2), (16, 20, 7)]
+)
+def test_sums_match_table(width, height, vision):
+    index = HexNeighborhoodIndex(mesa.space.HexGrid(width, height, torus=True))
+    field = np.random.default_rng(0).random((width * height, 3))
+    expected = field[index.table(vision)].sum(0)
+    assert np.allclose(index.sums(field, vision), expected)
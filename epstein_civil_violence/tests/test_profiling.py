@@ -0,0 +1,17 @@
+import pytest
+
+from epstein_civil_violence.model import EpsteinCivilViolence
+from epstein_civil_violence.profiling import ACTIVATION, ARRESTS, MOVEMENT
+
+
+@pytest.mark.parametrize("schedule_type", ["Random", "Staged", "Simultaneous"])
+def test_agent_phases_are_timed(schedule_type):
+    model = EpsteinCivilViolence(
+        width=20, height=20, schedule_type=schedule_type, profile=True, seed=1
+    )
+    for _ in range(3):
+        model.step()
+    seconds, calls = model.profiler.totals()
+    for phase in (ACTIVATION, ARRESTS, MOVEMENT):
+        assert calls[phase] > 0
+        assert seconds[phase] > 0
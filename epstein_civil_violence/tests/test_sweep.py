@@ -0,0 +1,82 @@
+import csv
+import os
+
+import pytest
+
+from epstein_civil_violence.sweep import run_sweep
+
+PARAMETERS = dict(width=12, height=12, citizen_vision=2, cop_vision=2, max_iters=5)
+
+
+def read(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def read_sweep(output, parameters, cache):
+    run_sweep(parameters, str(output), max_steps=5, processes=1, seed=1, cache=cache)
+    return read(output)
+
+
+def test_append_keeps_columns_and_skips_written_runs(tmp_path):
+    output = str(tmp_path / "runs.csv")
+    parameters = dict(PARAMETERS, schedule_type=("Random", "Simultaneous"))
+    run_sweep(parameters, output, max_steps=5, processes=1, seed=1)
+    run_sweep(parameters, output, max_steps=5, processes=1, seed=1)
+    assert len(read(output)) == 2
+    run_sweep(parameters, output, max_steps=5, processes=1, seed=2)
+    rows = read(output)
+    assert len(rows) == 4
+    assert {row["schedule_type"] for row in rows} == {"Random", "Simultaneous"}
+
+
+def test_append_with_other_columns_raises(tmp_path):
+    output = str(tmp_path / "runs.csv")
+    run_sweep(PARAMETERS, output, max_steps=5, processes=1, seed=1)
+    with pytest.raises(ValueError):
+        run_sweep(
+            dict(PARAMETERS, cop_density=(0.05, 0.1)),
+            output,
+            max_steps=5,
+            processes=1,
+            seed=1,
+        )
+    assert len(read(output)) == 1
+
+
+def test_cache_ignores_output_parameters(tmp_path):
+    cache = str(tmp_path / "cache")
+    first = read_sweep(tmp_path / "first.csv", PARAMETERS, cache)
+    # the cached run, under the columns of the sweep that reads it
+    spelled_out = read_sweep(
+        tmp_path / "spelled_out.csv", dict(PARAMETERS, profile=False), cache
+    )
+    assert [row["profile"] for row in spelled_out] == ["False"]
+    assert spelled_out[0]["seed"] == first[0]["seed"]
+    assert spelled_out[0]["Active"] == first[0]["Active"]
+    # asks for timings a cache hit would not have, so runs again
+    profiled = read_sweep(
+        tmp_path / "profiled.csv", dict(PARAMETERS, profile_columns=True), cache
+    )
+    assert profiled[0]["seed"] == first[0]["seed"]
+    assert "schedule_seconds" in profiled[0]
+    assert len(os.listdir(cache)) == 1
+
+
+def test_columnar_output_per_run(tmp_path):
+    pytest.importorskip("pyarrow")
+    output = str(tmp_path / "runs.csv")
+    columnar = str(tmp_path / "columnar")
+    parameters = dict(
+        PARAMETERS,
+        schedule_type=("Random", "Simultaneous"),
+        columnar_output=columnar,
+    )
+    run_sweep(parameters, output, max_steps=5, processes=1, seed=1)
+    rows = read(output)
+    directories = sorted(os.listdir(columnar))
+    assert directories == sorted(
+        f"run_{row['RunId']}_seed_{row['seed']}" for row in rows
+    )
+    for row in rows:
+        assert os.listdir(row["columnar_output"])